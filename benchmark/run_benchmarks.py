@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import tempfile
+import subprocess
+
+from argparse import ArgumentParser
+
+import numpy
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BENCHMARK_DIR, os.pardir)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'capacity_variation'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'speed_test'))
+
+import compute_metrics
+import process_speedtest
+
+from torbwest import parse
+from torbwest.archive import TorArchive, save_columns, get_index_ranges, get_chunk_size, init_worker_archive
+from torbwest.collector import get_input_paths
+from torbwest.util import setup_logging, CustomHelpFormatter
+
+# the benchmarks run in this process, one after the other, so that their times
+# measure the code itself rather than the process pool
+def main():
+    args = get_args()
+    setup_logging('benchmark')
+
+    params = {}
+    params_path = os.path.join(args.data, 'params.json')
+    if os.path.exists(params_path):
+        with open(params_path, 'r') as inf:
+            params = json.load(inf)
+
+    cons_paths = get_input_paths(os.path.join(args.data, 'cons'))
+    sdesc_paths = get_input_paths(os.path.join(args.data, 'sdesc'))
+
+    benchmarks = {}
+    scanners = [('stem', False), ('fast', True)] if args.fast else [('stem', False)]
+
+    for (name, fast_scan) in scanners:
+        parse.init_worker(fast_scan, 0.0)
+        cons_results = run_benchmark(benchmarks, 'process_cons_file.' + name, 'documents', parse_all, cons_paths, parse.process_cons_file, parse.process_cons_tarball)
+        sdesc_results = run_benchmark(benchmarks, 'process_sdesc_file.' + name, 'documents', parse_all, sdesc_paths, parse.process_sdesc_file, parse.process_sdesc_tarball)
+
+    cons_results = [r for r in cons_results if r is not None]
+    sdesc_results = [r for r in sdesc_results if r is not None]
+    columns = run_benchmark(benchmarks, 'merge_results', 'relays', count_relays, cons_results, sdesc_results)
+
+    archive_path = tempfile.mkdtemp(prefix='tor.archive.')
+    try:
+        run_benchmark(benchmarks, 'save_columns', None, save_columns, archive_path, columns)
+        tor_archive = TorArchive(archive_path)
+        init_worker_archive(archive_path)
+        work = get_index_ranges(len(tor_archive), get_chunk_size(len(tor_archive), os.cpu_count()))
+
+        rsd_configs = [(compute_metrics.BIN_DAYS, compute_metrics.START, compute_metrics.END)]
+        run_benchmark(benchmarks, 'compute_metrics.process_relay_range', 'relays', process_relays, work,
+            lambda index_range: compute_metrics.process_relay_range(rsd_configs, True, index_range))
+
+        # pretend that every other relay was measured
+        is_measured = numpy.arange(len(tor_archive)) % 2 == 0
+        windows = [process_speedtest.SPEEDTEST_WINDOW]
+        run_benchmark(benchmarks, 'process_speedtest.process_relay_range', 'relays', process_relays, work,
+            lambda index_range: process_speedtest.process_relay_range(windows, is_measured, index_range))
+    finally:
+        shutil.rmtree(archive_path)
+
+    record = {
+        'time': time.time(),
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'data': os.path.abspath(args.data),
+        'params': params,
+        'benchmarks': benchmarks,
+    }
+    compare(record, load_results(args.results))
+
+    logging.info("Appending results to '{}'".format(args.results))
+    with open(args.results, 'a') as outf:
+        outf.write(json.dumps(record) + '\n')
+
+# times func(*func_args), which returns its result and the number of items
+# (in unit) it processed, and stores the time in benchmarks[name]
+def run_benchmark(benchmarks, name, unit, func, *func_args):
+    logging.info("Running benchmark '{}'".format(name))
+    start = time.perf_counter()
+    result = func(*func_args)
+    seconds = time.perf_counter() - start
+
+    count = None
+    if unit is not None:
+        result, count = result
+    benchmarks[name] = {'seconds': seconds, 'count': count, 'unit': unit}
+    if count is not None and seconds > 0:
+        benchmarks[name]['rate'] = count / seconds
+        logging.info("Benchmark '{}' took {:.3f} seconds ({} {}, {:.1f} {}/s)".format(name, seconds, count, unit, count / seconds, unit))
+    else:
+        logging.info("Benchmark '{}' took {:.3f} seconds".format(name, seconds))
+    return result
+
+def parse_all(paths, file_func, tarball_func):
+    files, tarballs = paths
+    results = []
+    for path in files:
+        result = file_func(path)
+        results.extend(result if isinstance(result, list) else [result])
+    for path in tarballs:
+        results.extend(tarball_func(path))
+    return results, len(results)
+
+def count_relays(cons_results, sdesc_results):
+    columns = parse.merge_results(cons_results, sdesc_results)
+    return columns, len(columns['fingerprints'])
+
+def process_relays(work, func):
+    for index_range in work:
+        func(index_range)
+    return None, work[-1][1] if len(work) > 0 else 0
+
+# logs the speedup over the most recent result for the same data and parameters
+def compare(record, previous):
+    matches = [r for r in previous if r['data'] == record['data'] and r['params'] == record['params']]
+    if len(matches) == 0:
+        return
+    last = matches[-1]
+    logging.info("Comparing against the run at commit {} from {}".format(last['commit'], time.ctime(last['time'])))
+    for name in record['benchmarks']:
+        if name in last['benchmarks'] and record['benchmarks'][name]['seconds'] > 0:
+            speedup = last['benchmarks'][name]['seconds'] / record['benchmarks'][name]['seconds']
+            logging.info("Benchmark '{}': {:.3f} -> {:.3f} seconds ({:.2f}x)".format(name, last['benchmarks'][name]['seconds'], record['benchmarks'][name]['seconds'], speedup))
+
+def load_results(filename):
+    if not os.path.exists(filename):
+        return []
+    with open(filename, 'r') as inf:
+        return [json.loads(line) for line in inf if len(line.strip()) > 0]
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def get_args():
+    parser = ArgumentParser(
+            description='''Time the parse, merge, and per-relay processing code on a synthetic
+collector archive created with synthetic_collector.py''',
+            formatter_class=CustomHelpFormatter)
+
+    parser.add_argument('data', help="Path to the directory holding the cons and sdesc directories", metavar="PATH")
+    parser.add_argument('-f', '--fast', help="Also time the fast line scanners", action="store_true", default=False)
+    parser.add_argument('-r', '--results', help="Name of the file to append the results to, one json object per line", metavar="PATH", default="benchmark.results.jsonl")
+
+    args = parser.parse_args()
+    return args
+
+if __name__ == "__main__":
+    sys.exit(main())
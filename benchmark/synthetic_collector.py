@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+import io
+import os
+import sys
+import json
+import random
+import base64
+import binascii
+import logging
+import tarfile
+
+from datetime import datetime, timedelta
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from torbwest.util import setup_logging, CustomHelpFormatter
+
+# writes hourly consensuses to <output>/cons and server descriptors to
+# <output>/sdesc, laid out like the extracted collector tarballs (or as one
+# tarball per month, with --tarballs)
+def main():
+    args = get_args()
+    setup_logging('synthetic-collector')
+
+    start = datetime.strptime(args.start, "%Y-%m-%d")
+    end = add_months(start, args.months)
+    logging.info("Generating {} relays from {} to {} in '{}'".format(args.relays, start, end, args.output))
+
+    num_cons, num_sdesc = generate(args.output, args.relays, start, end, args.churn, args.bw_limit_changes, args.tarballs, random.Random(args.seed))
+    logging.info("Wrote {} consensuses and {} server descriptors".format(num_cons, num_sdesc))
+
+    # the benchmark runner records these with its results
+    params = dict(vars(args), num_cons=num_cons, num_sdesc=num_sdesc)
+    with open(os.path.join(args.output, 'params.json'), 'w') as outf:
+        json.dump(params, outf, indent=2)
+
+def add_months(date, months):
+    year, month = divmod(date.month - 1 + months, 12)
+    return date.replace(year=date.year + year, month=month + 1)
+
+def generate(output, num_relays, start, end, churn, bw_limit_changes, tarballs, rng):
+    relays = [make_relay(i, start, end, churn, rng) for i in range(num_relays)]
+
+    writer = TarballWriter(output) if tarballs else FileWriter(output)
+
+    num_cons = 0
+    t = start
+    while t < end:
+        writer.write('cons', t, '{}-consensus'.format(t.strftime('%Y-%m-%d-%H-%M-%S')), make_consensus(relays, t, rng))
+        num_cons += 1
+        t += timedelta(hours=1)
+
+    num_sdesc = 0
+    for relay in relays:
+        # descriptors are published every 6 to 20 hours (and from before the
+        # first consensus, so that every consensus has a descriptor to use)
+        t = max(start - timedelta(hours=20), relay['join'] - timedelta(hours=1))
+        while t < min(end, relay['leave']):
+            if rng.random() < bw_limit_changes:
+                relay['rate'] = rng.choice(RATES)
+            data = make_server_descriptor(relay, t, rng)
+            digest = '{:040x}'.format(rng.getrandbits(160))
+            writer.write('sdesc', t, os.path.join(digest[0], digest[1], digest), data)
+            num_sdesc += 1
+            t += timedelta(seconds=rng.randint(6*3600, 20*3600))
+
+    writer.close()
+    return num_cons, num_sdesc
+
+RATES = [10**6, 10**7, 10**8]
+
+def make_relay(i, start, end, churn, rng):
+    # a churn fraction of the relays join or leave during the period
+    period = (end - start).total_seconds()
+    join, leave = start, end
+    if rng.random() < churn:
+        join = start + timedelta(seconds=rng.uniform(0, period))
+    if rng.random() < churn:
+        leave = join + timedelta(seconds=rng.uniform(0, (end - join).total_seconds()))
+
+    fp = '{:040X}'.format(rng.getrandbits(160))
+    return {
+        'nickname': 'relay{}'.format(i),
+        'fp': fp,
+        'identity': base64.b64encode(binascii.unhexlify(fp)).decode().rstrip('='),
+        'address': '10.{}.{}.{}'.format(i // 65536 % 256, i // 256 % 256, i % 256),
+        'join': join,
+        'leave': leave,
+        'is_exit': rng.random() < 0.2,
+        'is_guard': rng.random() < 0.3,
+        'capacity': rng.lognormvariate(15, 1.5),
+        'rate': rng.choice(RATES),
+    }
+
+def make_consensus(relays, t, rng):
+    valid_after = t.strftime('%Y-%m-%d %H:%M:%S')
+    lines = [
+        '@type network-status-consensus-3 1.0',
+        'network-status-version 3',
+        'vote-status consensus',
+        'consensus-method 28',
+        'valid-after ' + valid_after,
+        'fresh-until ' + (t + timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S'),
+        'valid-until ' + (t + timedelta(hours=3)).strftime('%Y-%m-%d %H:%M:%S'),
+        'voting-delay 300 300',
+        'known-flags Exit Fast Guard Running Stable Valid',
+    ]
+    for relay in relays:
+        # relays also miss the occasional consensus while they are running
+        if t < relay['join'] or t >= relay['leave'] or rng.random() < 0.05:
+            continue
+        lines.append('r {} {} {} {} {} 9001 0'.format(relay['nickname'], relay['identity'], relay['identity'], valid_after, relay['address']))
+        flags = ['Fast', 'Running', 'Stable', 'Valid']
+        if relay['is_exit']: flags.append('Exit')
+        if relay['is_guard']: flags.append('Guard')
+        lines.append('s ' + ' '.join(sorted(flags)))
+        # new relays are unmeasured for their first couple of days
+        w = 'w Bandwidth={}'.format(max(1, int(relay['capacity'] / 1000 * rng.uniform(0.5, 1.5))))
+        if t < relay['join'] + timedelta(days=2):
+            w += ' Unmeasured=1'
+        lines.append(w)
+    lines.append('directory-footer')
+    return ('\n'.join(lines) + '\n').encode()
+
+def make_server_descriptor(relay, t, rng):
+    observed = int(relay['capacity'] * rng.uniform(0.2, 1.2))
+    lines = [
+        '@type server-descriptor 1.0',
+        'router {} {} 9001 0 0'.format(relay['nickname'], relay['address']),
+        'platform Tor 0.4.0.5 on Linux',
+        'published ' + t.strftime('%Y-%m-%d %H:%M:%S'),
+        'fingerprint ' + ' '.join(relay['fp'][k:k+4] for k in range(0, 40, 4)),
+        'bandwidth {} {} {}'.format(relay['rate'], relay['rate'] * 2, observed),
+        'router-signature',
+        '-----BEGIN SIGNATURE-----',
+        'AAAA',
+        '-----END SIGNATURE-----',
+    ]
+    return ('\n'.join(lines) + '\n').encode()
+
+class FileWriter(object):
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, kind, t, name, data):
+        path = os.path.join(self.output, kind, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as outf:
+            outf.write(data)
+
+    def close(self):
+        pass
+
+# one tarball per kind and month, named like the collector archives
+class TarballWriter(object):
+    NAMES = {'cons': 'consensuses', 'sdesc': 'server-descriptors'}
+
+    def __init__(self, output):
+        self.output = output
+        self.tarballs = {}
+
+    def write(self, kind, t, name, data):
+        key = (kind, t.strftime('%Y-%m'))
+        if key not in self.tarballs:
+            os.makedirs(os.path.join(self.output, kind), exist_ok=True)
+            path = os.path.join(self.output, kind, '{}-{}.tar.xz'.format(self.NAMES[kind], key[1]))
+            self.tarballs[key] = tarfile.open(path, 'w:xz')
+        info = tarfile.TarInfo(name='{}-{}/{}'.format(self.NAMES[kind], key[1], name))
+        info.size = len(data)
+        self.tarballs[key].addfile(info, io.BytesIO(data))
+
+    def close(self):
+        for tarball in self.tarballs.values():
+            tarball.close()
+
+def get_args():
+    parser = ArgumentParser(
+            description='Generate synthetic collector consensus and server descriptor archives for benchmarking',
+            formatter_class=CustomHelpFormatter)
+
+    parser.add_argument('output', help="Path to the directory in which to store the cons and sdesc directories", metavar="PATH")
+    parser.add_argument('-r', '--relays', help="Number of relays", metavar="N", type=int, default=1000)
+    parser.add_argument('-s', '--start', help="Date of the first consensus, as YYYY-MM-DD", metavar="DATE", default="2019-07-01")
+    parser.add_argument('-m', '--months', help="Number of months of hourly consensuses to generate", metavar="N", type=int, default=2)
+    parser.add_argument('-c', '--churn', help="Fraction of relays that join, and fraction that leave, during the period", metavar="FRACTION", type=float, default=0.2)
+    parser.add_argument('-b', '--bw-limit-changes', help="Probability that a relay changes its bandwidth rate limit before publishing a server descriptor", metavar="FRACTION", type=float, default=0.05)
+    parser.add_argument('-t', '--tarballs', help="Write one .tar.xz tarball per month like the collector archives instead of individual files", action="store_true", default=False)
+    parser.add_argument('--seed', help="Seed for the random number generator", type=int, default=1)
+
+    args = parser.parse_args()
+    return args
+
+if __name__ == "__main__":
+    sys.exit(main())
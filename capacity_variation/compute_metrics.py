@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import logging
+
+from datetime import datetime
+from functools import partial
+from argparse import ArgumentParser
+
+from numpy import isnan
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from torbwest.archive import TorArchive, map_relay_ranges, get_worker_archive
+from torbwest.metrics import position_fractions, uptime, mean_weight, mean_advbw, mean_rsds
+from torbwest.instrument import start_report
+from torbwest.timeseries import AdvBwSeries, POSITIONS, get_position_groups
+from torbwest.store import FORMATS, DEFAULT_FORMAT, save_data, save_relay_data
+from torbwest.util import setup_logging, CustomHelpFormatter
+
+# week 1 starts on 2018-08-01
+START = "2018-08-01"
+# week 52 starts on 2019-07-24 and ends at the end of 2019-07-30
+END = "2019-07-31"
+BIN_DAYS = 7
+
+# output name for each metric, stored as <name>.<format>; relays for which a
+# metric is undefined (e.g., no server descriptors) are left out of that
+# metric's output
+OUTPUTS = {
+    'position': 'relay_position',
+    'uptime': 'relay_uptime',
+    'weights': 'relay_weights',
+    'advbw': 'relay_advbw',
+}
+
+def main():
+    args = get_args()
+    setup_logging('processor')
+    report = start_report('processor')
+
+    rsd_configs = get_rsd_configs(args)
+    outputs = dict(OUTPUTS)
+    for config in rsd_configs:
+        outputs[config] = get_rsd_name(config)
+
+    with report.stage('load archive'):
+        logging.info("Loading parsed columnar archive from disk")
+        tor_archive = TorArchive('tor.archive')
+        logging.info("Got {} relays across {} consensus files".format(len(tor_archive), len(tor_archive.cons_times)))
+
+    with report.stage('compute metrics', unit='relays', count=len(tor_archive)):
+        # workers map the archive themselves and only receive relay index ranges
+        results = map_relay_ranges(tor_archive, partial(process_relay_range, rsd_configs, args.advbw_over_time))
+        relay_metrics = merge([range_results for (range_results, range_totals) in results], outputs)
+
+    with report.stage('save outputs'):
+        for name in outputs:
+            relays, values = relay_metrics[name]
+            logging.info("Storing '{}' for {} relays".format(outputs[name], len(relays)))
+            save_relay_data(tor_archive.fingerprints, relays, values, outputs[name], args.format)
+
+        if args.advbw_over_time:
+            advbw_over_time = AdvBwSeries(tor_archive.cons_times, POSITIONS)
+            for (range_results, range_totals) in results:
+                advbw_over_time.add_totals(range_totals)
+            logging.info("Storing network-wide adv bw by position for {} consensuses".format(len(advbw_over_time.cons_times)))
+            save_data(advbw_over_time.to_dict(), 'advbw_over_time', args.format)
+
+    report.finish(args.timing_report)
+    logging.info("All done!")
+
+# each rsd config is a (bin_days, start, end) tuple, with start and end as
+# YYYY-MM-DD strings and end exclusive; we compute every combination of the
+# requested bin sizes and date ranges
+def get_rsd_configs(args):
+    ranges = [tuple(r.split(':')) for r in args.rsd_ranges]
+    return [(days, start, end) for (start, end) in ranges for days in args.rsd_bin_days]
+
+def get_rsd_name(config):
+    # the default config keeps the name that plot_rsds.py reads
+    if config == (BIN_DAYS, START, END):
+        return 'relay_rsds'
+    return 'relay_rsds.{}d.{}.{}'.format(*config)
+
+def get_timestamp(date):
+    return datetime.strptime(date, "%Y-%m-%d").timestamp()
+
+# returns the ids of the relays for which each metric is defined, and their
+# values, in relay id order
+def merge(results, outputs):
+    # merge the results for all relays
+    logging.info("Merging relay results...")
+    relay_metrics = {name: ([], []) for name in outputs}
+    for range_results in results:
+        for (relay, metrics) in range_results:
+            for name in metrics:
+                if metrics[name] is not None:
+                    relay_metrics[name][0].append(relay)
+                    relay_metrics[name][1].append(metrics[name])
+    return relay_metrics
+
+# this func is run by helper processes in process pool
+def process_relay_range(rsd_configs, with_advbw_over_time, index_range):
+    tor_archive = get_worker_archive()
+    num_cons = len(tor_archive.cons_times)
+
+    # the rsds are computed for all relays in the range at once, reusing the
+    # range's timelines for every config
+    lo, hi = index_range
+    ct, st = tor_archive.cons_block(lo, hi), tor_archive.sdesc_block(lo, hi)
+    rsds = {}
+    for config in rsd_configs:
+        bin_days, start, end = config
+        rsds[config] = mean_rsds(ct, st, hi-lo, get_timestamp(start), get_timestamp(end), bin_days=bin_days)
+
+    results = []
+    for i in range(lo, hi):
+        metrics = process_relay_data(tor_archive.cons_view(i), tor_archive.sdesc_view(i), num_cons)
+        for config in rsd_configs:
+            rsd = rsds[config][i-lo]
+            metrics[config] = float(rsd) if not isnan(rsd) else None
+        results.append([i, metrics])
+
+    # the range's share of the network-wide adv bw in each consensus
+    totals = None
+    if with_advbw_over_time:
+        advbw_over_time = AdvBwSeries(tor_archive.cons_times, POSITIONS)
+        advbw_over_time.add_block(ct, st, get_position_groups(ct))
+        totals = advbw_over_time.totals
+
+    return results, totals
+
+# computes the non-rsd metrics for one relay while its timelines are at hand
+def process_relay_data(ct, st, num_cons):
+    return {
+        'position': position_fractions(ct),
+        'uptime': uptime(ct, num_cons),
+        'weights': mean_weight(ct),
+        'advbw': mean_advbw(st),
+    }
+
+def get_args():
+    parser = ArgumentParser(
+            description='''Compute per-relay metrics from the columnar archive produced with parse_tor_archive.py
+
+The rsds are computed for every combination of the given bin sizes and date
+ranges. The default {}-day bins over {}:{} are stored in
+relay_rsds.<FORMAT>; other configs are stored in
+relay_rsds.<DAYS>d.<START>.<END>.<FORMAT>'''.format(BIN_DAYS, START, END),
+            formatter_class=CustomHelpFormatter)
+
+    parser.add_argument('-b', '--rsd-bin-days', help="Compute the rsd over bins of each of the given number of days", metavar="DAYS", type=int, nargs='+', default=[BIN_DAYS])
+    parser.add_argument('-r', '--rsd-ranges', help="Compute the rsd over descriptors published in each of the given date ranges, from START up to (but not including) END", metavar="START:END", nargs='+', default=["{}:{}".format(START, END)])
+    parser.add_argument('-a', '--advbw-over-time', help="Also store the network-wide advertised bandwidth in each consensus, in total and by relay position, in advbw_over_time.<FORMAT>", action="store_true", default=False)
+    parser.add_argument('-f', '--format', help="Format to store the outputs in; npz files are faster to write and load than json.xz files", choices=FORMATS, default=DEFAULT_FORMAT)
+
+    parser.add_argument('-t', '--timing-report', help="Name of the file to store a json report of the time, throughput, and memory usage of each stage in", metavar="PATH", default="processor.timing.json")
+
+    args = parser.parse_args()
+    if min(args.rsd_bin_days) < 1:
+        parser.error("bin sizes must be at least 1 day")
+    for r in args.rsd_ranges:
+        try:
+            start, end = r.split(':')
+            if get_timestamp(start) >= get_timestamp(end):
+                parser.error("range '{}' is empty".format(r))
+        except ValueError:
+            parser.error("range '{}' is not in START:END format with YYYY-MM-DD dates".format(r))
+    return args
+
+if __name__ == "__main__":
+    sys.exit(main())
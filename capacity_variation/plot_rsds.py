@@ -2,32 +2,29 @@
 
 import sys
 import os
-import json
-import lzma
-
-from datetime import datetime
 
 import matplotlib
 matplotlib.use('Agg') # for systems without X11
 import matplotlib.pyplot as pyplot
-from matplotlib.backends.backend_pdf import PdfPages
-from matplotlib.ticker import MultipleLocator
 
-from numpy import arange, isnan, mean, median, std
-from scipy.stats import scoreatpercentile as score
-from scipy.stats import linregress
+from numpy import isnan
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from torbwest.plot import set_plot_options, getcdf, print_stats
+from torbwest.metrics import get_relay_positions
+from torbwest.store import load_relay_data, load_relay_columns
 
 def main():
-    with lzma.open('relay_rsds.json.xz') as inf:
-        relay_rsds = json.load(inf)
-    with lzma.open('relay_uptime.json.xz') as inf:
-        relay_uptime = json.load(inf)
-    with lzma.open('relay_position.json.xz') as inf:
-        relay_position = json.load(inf)
-    with lzma.open('relay_advbw.json.xz') as inf:
-        relay_advbw = json.load(inf)
-    with lzma.open('relay_weights.json.xz') as inf:
-        relay_weights = json.load(inf)
+    fingerprints, relays, rsds = load_relay_data('relay_rsds')
+
+    # the other metrics are joined onto the relays with rsds by relay id, and
+    # are nan for relays for which they are undefined
+    relay_rsds = rsds['values']
+    relay_uptime = load_relay_columns('relay_uptime', fingerprints)['values'][relays]
+    positions = load_relay_columns('relay_position', fingerprints)
+    relay_position = get_relay_positions(*[positions['values.' + p][relays] for p in ['exit', 'guard', 'middle']])
+    relay_advbw = load_relay_columns('relay_advbw', fingerprints)['values'][relays]
+    relay_weights = load_relay_columns('relay_weights', fingerprints)['values'][relays]
 
     set_plot_options()
 
@@ -40,20 +37,17 @@ def plot_rsd_weight(relay_rsds, relay_weights):
     filename = "capacity_rsds_weight_cdf.pdf"
     print(filename)
 
-    all_weight = sorted([relay_weights[fp] for fp in relay_rsds if fp in relay_weights])
+    all_weight = sorted(relay_weights[~isnan(relay_weights)].tolist())
     cut_low = all_weight[int(len(all_weight)/3.0)]
     cut_high = all_weight[int(2.0*len(all_weight)/3.0)]
 
     fig = pyplot.figure()
 
-    all = [relay_rsds[fp]*100.0 for fp in relay_rsds]
+    all = (relay_rsds*100.0).tolist()
 
-    low = [relay_rsds[fp]*100.0 for fp in relay_rsds \
-        if fp in relay_weights and relay_weights[fp] <= cut_low]
-    mid = [relay_rsds[fp]*100.0 for fp in relay_rsds \
-        if fp in relay_weights and relay_weights[fp] > cut_low and relay_weights[fp] <= cut_high]
-    high = [relay_rsds[fp]*100.0 for fp in relay_rsds \
-        if fp in relay_weights and relay_weights[fp] > cut_high]
+    low = (relay_rsds[relay_weights <= cut_low]*100.0).tolist()
+    mid = (relay_rsds[(relay_weights > cut_low) & (relay_weights <= cut_high)]*100.0).tolist()
+    high = (relay_rsds[relay_weights > cut_high]*100.0).tolist()
 
     x, y = getcdf(all)
     label = "All"
@@ -88,20 +82,17 @@ def plot_rsd_capacity(relay_rsds, relay_advbw):
     filename = "capacity_rsds_advbw_cdf.pdf"
     print(filename)
 
-    all_bw = sorted([relay_advbw[fp] for fp in relay_rsds if fp in relay_advbw])
+    all_bw = sorted(relay_advbw[~isnan(relay_advbw)].tolist())
     cut_low = all_bw[int(len(all_bw)/3.0)]
     cut_high = all_bw[int(2.0*len(all_bw)/3.0)]
 
     fig = pyplot.figure()
 
-    all = [relay_rsds[fp]*100.0 for fp in relay_rsds]
+    all = (relay_rsds*100.0).tolist()
 
-    low = [relay_rsds[fp]*100.0 for fp in relay_rsds \
-        if fp in relay_advbw and relay_advbw[fp] <= cut_low]
-    mid = [relay_rsds[fp]*100.0 for fp in relay_rsds \
-        if fp in relay_advbw and relay_advbw[fp] > cut_low and relay_advbw[fp] <= cut_high]
-    high = [relay_rsds[fp]*100.0 for fp in relay_rsds \
-        if fp in relay_advbw and relay_advbw[fp] > cut_high]
+    low = (relay_rsds[relay_advbw <= cut_low]*100.0).tolist()
+    mid = (relay_rsds[(relay_advbw > cut_low) & (relay_advbw <= cut_high)]*100.0).tolist()
+    high = (relay_rsds[relay_advbw > cut_high]*100.0).tolist()
 
     x, y = getcdf(all)
     label = "All"
@@ -141,13 +132,10 @@ def plot_rsd_uptime(relay_rsds, relay_uptime):
 
     fig = pyplot.figure()
 
-    all = [relay_rsds[fp]*100.0 for fp in relay_rsds]
-    low = [relay_rsds[fp]*100.0 for fp in relay_rsds \
-        if fp in relay_uptime and relay_uptime[fp] <= cut_low]
-    mid = [relay_rsds[fp]*100.0 for fp in relay_rsds \
-        if fp in relay_uptime and relay_uptime[fp] > cut_low and relay_uptime[fp] <= cut_high]
-    high = [relay_rsds[fp]*100.0 for fp in relay_rsds \
-        if fp in relay_uptime and relay_uptime[fp] > cut_high]
+    all = (relay_rsds*100.0).tolist()
+    low = (relay_rsds[relay_uptime <= cut_low]*100.0).tolist()
+    mid = (relay_rsds[(relay_uptime > cut_low) & (relay_uptime <= cut_high)]*100.0).tolist()
+    high = (relay_rsds[relay_uptime > cut_high]*100.0).tolist()
 
     x, y = getcdf(all)
     label = "All"
@@ -184,10 +172,10 @@ def plot_rsd_position(relay_rsds, relay_position):
 
     fig = pyplot.figure()
 
-    all = [relay_rsds[fp]*100.0 for fp in relay_rsds]
-    exit = [relay_rsds[fp]*100.0 for fp in relay_rsds if get_relay_position(relay_position, fp) == 'exit']
-    guard = [relay_rsds[fp]*100.0 for fp in relay_rsds if get_relay_position(relay_position, fp) == 'guard']
-    middle = [relay_rsds[fp]*100.0 for fp in relay_rsds if get_relay_position(relay_position, fp) == 'middle']
+    all = (relay_rsds*100.0).tolist()
+    exit = (relay_rsds[relay_position == 'exit']*100.0).tolist()
+    guard = (relay_rsds[relay_position == 'guard']*100.0).tolist()
+    middle = (relay_rsds[relay_position == 'middle']*100.0).tolist()
 
     x, y = getcdf(all)
     label = "All"
@@ -218,89 +206,4 @@ def plot_rsd_position(relay_rsds, relay_position):
     pyplot.tight_layout(pad=0.3)
     pyplot.savefig(filename)
 
-def get_relay_position(relays, fp):
-    if fp not in relays:
-        return 'na'
-    p = relays[fp]
-    if p['exit'] > p['guard'] and p['exit'] > p['middle']:
-        return 'exit'
-    elif p['guard'] > p['exit'] and p['guard'] > p['middle']:
-        return 'guard'
-    else:
-        return 'middle'
-
-def set_plot_options():
-    options = {
-        #'backend': 'PDF',
-        'font.size': 12,
-        'figure.figsize': (3,2.0),
-        'figure.dpi': 100.0,
-        'figure.subplot.left': 0.20,
-        'figure.subplot.right': 0.97,
-        'figure.subplot.bottom': 0.20,
-        'figure.subplot.top': 0.90,
-        'grid.color': '0.1',
-        'grid.linestyle': ':',
-        #'grid.linewidth': 0.5,
-        'axes.grid' : True,
-        #'axes.grid.axis' : 'y',
-        #'axes.axisbelow': True,
-        'axes.titlesize' : 'x-small',
-        'axes.labelsize' : 8,
-        'axes.formatter.limits': (-4,4),
-        'xtick.labelsize' : 7,
-        'ytick.labelsize' : 7,
-        'lines.linewidth' : 2.0,
-        'lines.markeredgewidth' : 0.5,
-        'lines.markersize' : 2,
-        'legend.fontsize' : 7,
-        'legend.fancybox' : False,
-        'legend.shadow' : False,
-        'legend.borderaxespad' : 0.5,
-        'legend.numpoints' : 1,
-        'legend.handletextpad' : 0.5,
-        'legend.handlelength' : 2.0,
-        'legend.labelspacing' : .75,
-        'legend.markerscale' : 1.0,
-        # turn on the following to embedd fonts; requires latex
-        'ps.useafm' : True,
-        'pdf.use14corefonts' : True,
-        'text.usetex' : True,
-    }
-
-    for option_key in options:
-        matplotlib.rcParams[option_key] = options[option_key]
-
-    if 'figure.max_num_figures' in matplotlib.rcParams:
-        matplotlib.rcParams['figure.max_num_figures'] = 50
-    if 'figure.max_open_warning' in matplotlib.rcParams:
-        matplotlib.rcParams['figure.max_open_warning'] = 50
-    if 'legend.ncol' in matplotlib.rcParams:
-        matplotlib.rcParams['legend.ncol'] = 50
-
-## helper - cumulative fraction for y axis
-def cf(d): return arange(1.0,float(len(d))+1.0)/float(len(d))
-
-## helper - return step-based CDF x and y values
-## only show to the 99th percentile by default
-def getcdf(data, shownpercentile=1.0, maxpoints=100000.0):
-    data.sort()
-    frac = cf(data)
-    k = len(data)/maxpoints
-    x, y, lasty = [], [], 0.0
-    for i in range(int(round(len(data)*shownpercentile))):
-        if i % k > 1.0: continue
-        assert not isnan(data[i])
-        x.append(data[i])
-        y.append(lasty)
-        x.append(data[i])
-        y.append(frac[i])
-        lasty = frac[i]
-    return x, y
-
-def print_stats(msg, dist):
-    b = sorted(dist)#.values()
-    print(msg)
-    print("\tlength={}\n\tmin={}\n\t10={}\n\tq1={}\n\tmedian={}\n\tq3={}\n\t90={}\n\tmax={}\n\tmean={}\n\tstddev={}".format(len(b), min(b), score(b, 10), score(b, 25), median(b), score(b, 75), score(b, 90), max(b), mean(b), std(b)))
-
 if __name__ == '__main__': main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import lzma
+import json
+
+import numpy
+
+# Extracts the capacity of each measured relay from the BW log that
+# speedtester.py writes. These capacities are computed differently from the
+# 'capacity' that speedtester.py stores in its state, so the two can disagree
+# for the same run: see get_capacities.
+
+# must match BW_LOG_MAGIC and BW_RECORD in speedtester.py
+BW_LOG_MAGIC = b'SPDTBW01'
+BW_DTYPE = numpy.dtype([('ts', '<f8'), ('ctrl_port', '<u2'), ('circid', '<u4'), ('read', '<u8'), ('written', '<u8'), ('target', 'S20')])
+
+def main():
+    records = load_bw_log("speedtester.bw.log")
+    print(f"Got {len(records)} BW events")
+
+    capacity = get_capacities(records)
+    print(f"Got the measured capacity of {len(capacity)} relays")
+
+    with lzma.open("speedtest.capacity.json.xz", 'wt') as outf:
+        json.dump(capacity, outf, indent=2)
+
+# a partial record at the end of the log (from a crash) is ignored
+def load_bw_log(filename):
+    with open(filename, 'rb') as inf:
+        if inf.read(len(BW_LOG_MAGIC)) != BW_LOG_MAGIC:
+            raise ValueError(f"'{filename}' is not a speed test BW log")
+    count = (os.path.getsize(filename) - len(BW_LOG_MAGIC)) // BW_DTYPE.itemsize
+    return numpy.fromfile(filename, dtype=BW_DTYPE, count=count, offset=len(BW_LOG_MAGIC))
+
+# returns the highest number of bytes that the clients measuring each target
+# read, wrote, and transferred in total in any one second, keyed by the
+# target's fingerprint, along with the number of seconds we have BW events for.
+#
+# The bytes of the clients are summed by wall-clock second (the floor of each
+# event's timestamp). speedtester.py instead adds up the clients' n-th BW events
+# since they STARTED, in the order each client reported them. Clients report at
+# different sub-second offsets, so a client's event can fall into the
+# neighbouring wall-clock second here, and the peaks can differ. The log does
+# not record the clients' status, so the controller's pairing cannot be
+# reproduced: it also holds the events from before the burst started and after
+# it stopped.
+def get_capacities(records):
+    if len(records) == 0:
+        return {}
+
+    # sum the bytes of all clients in each second of each target
+    targets, target_ids = numpy.unique(records['target'], return_inverse=True)
+    seconds = numpy.floor(records['ts']).astype('int64')
+    order = numpy.lexsort((seconds, target_ids))
+    target_ids, seconds = target_ids[order], seconds[order]
+
+    is_first = numpy.ones(len(order), dtype=bool)
+    is_first[1:] = (target_ids[1:] != target_ids[:-1]) | (seconds[1:] != seconds[:-1])
+    starts = numpy.flatnonzero(is_first)
+    read = numpy.add.reduceat(records['read'][order], starts)
+    written = numpy.add.reduceat(records['written'][order], starts)
+
+    # then take the highest second of each target
+    second_targets = target_ids[starts]
+    target_starts = numpy.flatnonzero(numpy.diff(second_targets, prepend=-1) != 0)
+    counts = numpy.diff(numpy.append(target_starts, len(second_targets)))
+
+    capacity = {}
+    for (target_id, start, count) in zip(second_targets[target_starts], target_starts, counts):
+        # numpy drops the trailing null bytes of 'S' fields
+        fp = targets[target_id].ljust(20, b'\0').hex().upper()
+        capacity[fp] = {
+            'read': int(read[start:start+count].max()),
+            'written': int(written[start:start+count].max()),
+            'total': int((read[start:start+count] + written[start:start+count]).max()),
+            'seconds': int(count),
+        }
+    return capacity
+
+if __name__ == '__main__': sys.exit(main())
@@ -2,20 +2,18 @@
 
 import sys
 import os
-import json
-import lzma
-
-from datetime import datetime
 
 import matplotlib
 matplotlib.use('Agg') # for systems without X11
 import matplotlib.pyplot as pyplot
-from matplotlib.backends.backend_pdf import PdfPages
-from matplotlib.ticker import MultipleLocator
 
-from numpy import arange, isnan, mean, median, std
-from scipy.stats import scoreatpercentile as score
-from scipy.stats import linregress
+from numpy import isnan, zeros
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from torbwest.plot import set_plot_options, getcdf, print_stats
+from torbwest.archive import lookup_fingerprints
+from torbwest.metrics import get_relay_positions
+from torbwest.store import load_data, load_relay_data, load_relay_columns
 
 he1_ips = ['65.19.167.130', '65.19.167.131', '65.19.167.132', '65.19.167.133', '65.19.167.134']
 he2_ips = ['216.218.222.10', '216.218.222.11', '216.218.222.12', '216.218.222.13', '216.218.222.14']
@@ -25,17 +23,6 @@ he2_ips = ['216.218.222.10', '216.218.222.11', '216.218.222.12', '216.218.222.13
 # if you set this to true, it will also produce plots that we did not include
 GENERATE_EXTRA_PLOTS=False
 
-def get_relay_position(relays, fp):
-    if fp not in relays:
-        return 'na'
-    p = relays[fp]
-    if p['exit'] > p['guard'] and p['exit'] > p['middle']:
-        return 'exit'
-    elif p['guard'] > p['exit'] and p['guard'] > p['middle']:
-        return 'guard'
-    else:
-        return 'middle'
-
 def print_overall_stats(data, pos=None):
     if pos is not None:
         before = [float(item[0]) for item in data if item[5] == pos]
@@ -54,48 +41,44 @@ def print_overall_stats(data, pos=None):
     print(f"{'Total' if pos is None else pos} Tor Capacity relative discovered: {100.0*sum(discovered)/sum(after)} \%")
     print(f"{'Total' if pos is None else pos} absolute change is selection prob.: {100.0*sum(weight_change)} \%")
 
-def load_filtered(measured_fps, filename):
-    with lzma.open(filename) as inf:
-        data = json.load(inf)
-    if measured_fps is None:
-        return data
-    else:
-        return {fp: data[fp] for fp in data if fp in measured_fps}
-
 def load():
+    fingerprints, relays, relay_diffs = load_relay_data('speedtest.diffs')
+
     # if you don't want to filter the relays down to only those that we were
-    # able to actively measure, set measured_fps to None rather than loading
+    # able to actively measure, set is_measured to all True rather than loading
     # file here
-    with lzma.open('speedtest.measured.json.xz') as inf:
-        measured_fps = json.load(inf)
+    measured = lookup_fingerprints(fingerprints, load_data('speedtest.measured'))
+    is_measured = zeros(len(fingerprints), dtype=bool)
+    is_measured[measured[measured >= 0]] = True
 
-    relay_diffs = load_filtered(measured_fps, 'speedtest.diffs.json.xz')
-    relay_uptime = load_filtered(measured_fps, 'relay_uptime.json.xz')
-    relay_position = load_filtered(measured_fps, 'relay_position.json.xz')
+    keep = is_measured[relays]
+    relays = relays[keep]
+    relay_diffs = {path: values[keep].tolist() for (path, values) in relay_diffs.items()}
+
+    # the capacity variation metrics are joined onto the diffs by relay id, and
+    # are nan for relays for which they are undefined
+    relay_uptime = load_relay_columns('relay_uptime', fingerprints)['values'][relays].tolist()
+    positions = load_relay_columns('relay_position', fingerprints)
+    relay_position = get_relay_positions(*[positions['values.' + p][relays] for p in ['exit', 'guard', 'middle']]).tolist()
 
     return relay_diffs, relay_uptime, relay_position
 
 def main():
     relay_diffs, relay_uptime, relay_position = load()
-    set_plot_options()
+    set_plot_options({'legend.fontsize': 6})
 
     data = []
-    for fp in relay_diffs:
-        if "advbw" in relay_diffs[fp] and "weight" in relay_diffs[fp] and \
-                "before" in relay_diffs[fp]["advbw"] and \
-                "after" in relay_diffs[fp]["advbw"] and \
-                "before" in relay_diffs[fp]["weight"] and \
-                "after" in relay_diffs[fp]["weight"]:
-            cap_before = int(relay_diffs[fp]["advbw"]["before"])/125000.0 # bytes to mbits
-            cap_after = int(relay_diffs[fp]["advbw"]["after"])/125000.0 # bytes to mbits
+    for i in range(len(relay_uptime)):
+        cap_before = relay_diffs["values.advbw.before"][i]/125000.0 # bytes to mbits
+        cap_after = relay_diffs["values.advbw.after"][i]/125000.0 # bytes to mbits
 
-            weight_before = float(relay_diffs[fp]["weight"]["before"])
-            weight_after = float(relay_diffs[fp]["weight"]["after"])
+        weight_before = relay_diffs["values.weight.before"][i]
+        weight_after = relay_diffs["values.weight.after"][i]
 
-            percent_uptime = relay_uptime[fp] if fp in relay_uptime else 0
-            position = get_relay_position(relay_position, fp)
+        percent_uptime = relay_uptime[i] if not isnan(relay_uptime[i]) else 0
+        position = relay_position[i]
 
-            data.append([cap_before, cap_after, weight_before, weight_after, percent_uptime, position])
+        data.append([cap_before, cap_after, weight_before, weight_after, percent_uptime, position])
 
     # rank relays by "after" capacity
     data.sort(key=lambda item: item[1])
@@ -711,78 +694,4 @@ def plot_cdf_split(data, ranked_data, label_prefix):
     pyplot.plot(x, y, label=label, ls=":")
     print_stats("CDF stat summary: "+label, data[p75_index:])
 
-def set_plot_options():
-    options = {
-        #'backend': 'PDF',
-        'font.size': 12,
-        'figure.figsize': (3,2.0),
-        'figure.dpi': 100.0,
-        'figure.subplot.left': 0.20,
-        'figure.subplot.right': 0.97,
-        'figure.subplot.bottom': 0.20,
-        'figure.subplot.top': 0.90,
-        'grid.color': '0.1',
-        'grid.linestyle': ':',
-        #'grid.linewidth': 0.5,
-        'axes.grid' : True,
-        #'axes.grid.axis' : 'y',
-        #'axes.axisbelow': True,
-        'axes.titlesize' : 'x-small',
-        'axes.labelsize' : 8,
-        'axes.formatter.limits': (-4,4),
-        'xtick.labelsize' : 7,
-        'ytick.labelsize' : 7,
-        'lines.linewidth' : 2.0,
-        'lines.markeredgewidth' : 0.5,
-        'lines.markersize' : 2,
-        'legend.fontsize' : 6,
-        'legend.fancybox' : False,
-        'legend.shadow' : False,
-        'legend.borderaxespad' : 0.5,
-        'legend.numpoints' : 1,
-        'legend.handletextpad' : 0.5,
-        'legend.handlelength' : 2.0,
-        'legend.labelspacing' : .75,
-        'legend.markerscale' : 1.0,
-        # turn on the following to embedd fonts; requires latex
-        'ps.useafm' : True,
-        'pdf.use14corefonts' : True,
-        'text.usetex' : True,
-    }
-
-    for option_key in options:
-        matplotlib.rcParams[option_key] = options[option_key]
-
-    if 'figure.max_num_figures' in matplotlib.rcParams:
-        matplotlib.rcParams['figure.max_num_figures'] = 50
-    if 'figure.max_open_warning' in matplotlib.rcParams:
-        matplotlib.rcParams['figure.max_open_warning'] = 50
-    if 'legend.ncol' in matplotlib.rcParams:
-        matplotlib.rcParams['legend.ncol'] = 50
-
-## helper - cumulative fraction for y axis
-def cf(d): return arange(1.0,float(len(d))+1.0)/float(len(d))
-
-## helper - return step-based CDF x and y values
-## only show to the 99th percentile by default
-def getcdf(data, shownpercentile=1.0, maxpoints=100000.0):
-    data.sort()
-    frac = cf(data)
-    k = len(data)/maxpoints
-    x, y, lasty = [], [], 0.0
-    for i in range(int(round(len(data)*shownpercentile))):
-        if i % k > 1.0: continue
-        assert not isnan(data[i])
-        x.append(data[i])
-        y.append(lasty)
-        x.append(data[i])
-        y.append(frac[i])
-        lasty = frac[i]
-    return x, y
-
-def print_stats(msg, dist):
-    b = sorted(dist)#.values()
-    print(msg)
-    print("\tlength={}\n\tmin={}\n\t10={}\n\tq1={}\n\tmedian={}\n\tq3={}\n\t90={}\n\tmax={}\n\tmean={}\n\tstddev={}".format(len(b), min(b), score(b, 10), score(b, 25), median(b), score(b, 75), score(b, 90), max(b), mean(b), std(b)))
-
 if __name__ == '__main__': main()
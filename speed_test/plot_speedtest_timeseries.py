@@ -2,19 +2,16 @@
 
 import sys
 import os
-import lzma
-import json
 
 from datetime import datetime
 
 import matplotlib
 matplotlib.use('Agg') # for systems without X11
 import matplotlib.pyplot as pyplot
-from matplotlib.backends.backend_pdf import PdfPages
 
-from numpy import arange, isnan, mean, median, std
-from scipy.stats import scoreatpercentile as score
-from scipy.stats import linregress
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from torbwest.plot import set_plot_options, print_stats
+from torbwest.store import load_data
 
 MIN = datetime.strptime("2019-08-01 00:00:00", "%Y-%m-%d %H:%M:%S").timestamp()
 SPEEDTEST_START_TS = datetime.strptime("2019-08-06 16:30:00", "%Y-%m-%d %H:%M:%S").timestamp()
@@ -24,10 +21,13 @@ BW_EXPIRE_END_TS = BW_EXPIRE_START_TS + (SPEEDTEST_END_TS-SPEEDTEST_START_TS)
 MAX=datetime.strptime("2019-08-18 18:30:00", "%Y-%m-%d %H:%M:%S").timestamp()
 
 def main():
-    set_plot_options()
+    set_plot_options({
+        'legend.borderaxespad' : 0.25,
+        'legend.handlelength' : 1.25,
+        'legend.columnspacing': 1.0,
+    })
 
-    with lzma.open('advbw_over_time.json.xz') as inf:
-        advbw_over_time = json.load(inf)
+    advbw_over_time = load_data('advbw_over_time')
 
     times = sorted([float(ts_str) for ts_str in advbw_over_time])
 
@@ -93,81 +93,6 @@ def main():
     for p in sorted(periods.keys()):
         print("")
         for k in sorted(periods[p].keys()):
-            print_stats(f"Period={p} sum={k}: ", periods[p][k])
-
-def set_plot_options():
-    options = {
-        #'backend': 'PDF',
-        'font.size': 12,
-        'figure.figsize': (3,2.0),
-        'figure.dpi': 100.0,
-        'figure.subplot.left': 0.20,
-        'figure.subplot.right': 0.97,
-        'figure.subplot.bottom': 0.20,
-        'figure.subplot.top': 0.90,
-        'grid.color': '0.1',
-        'grid.linestyle': ':',
-        #'grid.linewidth': 0.5,
-        'axes.grid' : True,
-        #'axes.grid.axis' : 'y',
-        #'axes.axisbelow': True,
-        'axes.titlesize' : 'x-small',
-        'axes.labelsize' : 8,
-        'axes.formatter.limits': (-4,4),
-        'xtick.labelsize' : 7,
-        'ytick.labelsize' : 7,
-        'lines.linewidth' : 2.0,
-        'lines.markeredgewidth' : 0.5,
-        'lines.markersize' : 2,
-        'legend.fontsize' : 7,
-        'legend.fancybox' : False,
-        'legend.shadow' : False,
-        'legend.borderaxespad' : 0.25,
-        'legend.numpoints' : 1,
-        'legend.handletextpad' : 0.5,
-        'legend.handlelength' : 1.25,
-        'legend.labelspacing' : .75,
-        'legend.markerscale' : 1.0,
-        'legend.columnspacing': 1.0,
-        # turn on the following to embedd fonts; requires latex
-        'ps.useafm' : True,
-        'pdf.use14corefonts' : True,
-        'text.usetex' : True,
-    }
-
-    for option_key in options:
-        matplotlib.rcParams[option_key] = options[option_key]
-
-    if 'figure.max_num_figures' in matplotlib.rcParams:
-        matplotlib.rcParams['figure.max_num_figures'] = 50
-    if 'figure.max_open_warning' in matplotlib.rcParams:
-        matplotlib.rcParams['figure.max_open_warning'] = 50
-    if 'legend.ncol' in matplotlib.rcParams:
-        matplotlib.rcParams['legend.ncol'] = 50
-
-## helper - cumulative fraction for y axis
-def cf(d): return arange(1.0,float(len(d))+1.0)/float(len(d))
-
-## helper - return step-based CDF x and y values
-## only show to the 99th percentile by default
-def getcdf(data, shownpercentile=1.0, maxpoints=100000.0):
-    data.sort()
-    frac = cf(data)
-    k = len(data)/maxpoints
-    x, y, lasty = [], [], 0.0
-    for i in range(int(round(len(data)*shownpercentile))):
-        if i % k > 1.0: continue
-        assert not isnan(data[i])
-        x.append(data[i])
-        y.append(lasty)
-        x.append(data[i])
-        y.append(frac[i])
-        lasty = frac[i]
-    return x, y
-
-def print_stats(msg, dist):
-    b = sorted(dist)#.values()
-    print(msg)
-    print("min={} q1={} median={} q3={} max={} mean={} stddev={}".format(min(b), score(b, 25), median(b), score(b, 75), max(b), mean(b), std(b)))
+            print_stats(f"Period={p} sum={k}: ", periods[p][k], compact=True)
 
 if __name__ == '__main__': main()
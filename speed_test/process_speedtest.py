@@ -3,15 +3,22 @@
 import os
 import sys
 import json
-import lzma
 import logging
 import subprocess
 
 from datetime import datetime
-from multiprocessing import Pool, cpu_count
-from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from functools import partial
+from argparse import ArgumentParser
 
-from numpy import mean, median, std
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from torbwest.archive import TorArchive, map_relay_ranges, get_worker_archive, lookup_fingerprints
+from torbwest.metrics import window_diffs
+from torbwest.instrument import start_report
+from torbwest.timeseries import AdvBwSeries, get_relay_groups
+from torbwest.store import FORMATS, DEFAULT_FORMAT, save_data, save_relay_data, load_data
+from torbwest.util import setup_logging, CustomHelpFormatter
 
 MIN=datetime.strptime("2019-08-01 00:00:00", "%Y-%m-%d %H:%M:%S").timestamp()
 START=datetime.strptime("2019-08-06 16:30:00", "%Y-%m-%d %H:%M:%S").timestamp()
@@ -19,155 +26,136 @@ START=datetime.strptime("2019-08-06 16:30:00", "%Y-%m-%d %H:%M:%S").timestamp()
 STOP=datetime.strptime("2019-08-12 00:30:00", "%Y-%m-%d %H:%M:%S").timestamp()
 MAX=datetime.strptime("2019-08-18 18:30:00", "%Y-%m-%d %H:%M:%S").timestamp()
 
+# the speed test window; its results are stored in speedtest.diffs.<format>
+SPEEDTEST_WINDOW = {'name': 'speedtest', 'min': MIN, 'start': START, 'stop': STOP}
+
 def main():
     args = get_args()
-    setup_logging(args.logfile)
-    run(args)
-
-def run(args):
-    logging.info("Loading parsed json data from disk...")
-
-    with lzma.open('speedtest.measured.json.xz') as inf:
-        measured_fps = json.load(inf)
-    with open('tor.archive.json', 'r') as inf: # from 2019-08-01 to 2019-08-21
-        data = json.load(inf)
-
-    logging.info("done.")
-
-    worker_pool = Pool(cpu_count())
-
-    logging.info("Processing data...")
-
-    advbw_over_time = {ts: {'total':0, 'measured':0, 'unmeasured':0} for ts in data['cons_times']}
-    speedtest = {}
-
-    work = [[fp, data['relays'][fp], data['cons_times']] for fp in data['relays']]
-    for result in parallelize(worker_pool, process_relay_data, work):
-        if result == None:
-            continue
-        fp, relay_data, relay_advbw_over_time = result
-        speedtest[fp] = relay_data
-
-        for ts in relay_advbw_over_time:
-            advbw_over_time[ts]['total'] += relay_advbw_over_time[ts]
-            if fp in measured_fps:
-                advbw_over_time[ts]['measured'] += relay_advbw_over_time[ts]
-            else:
-                advbw_over_time[ts]['unmeasured'] += relay_advbw_over_time[ts]
-
-    logging.info("Got results for {} relays.".format(len(speedtest)))
-    with lzma.open('speedtest.diffs.json.xz', 'wt') as outf:
-        json.dump(speedtest, outf, indent=2)
-    with lzma.open('advbw_over_time.json.xz', 'wt') as outf:
-        json.dump(advbw_over_time, outf, indent=2)
+    setup_logging('processor', args.logfile)
+    report = start_report('processor')
+    run(args, report)
+    report.finish(args.timing_report)
+
+def run(args, report):
+    windows = [SPEEDTEST_WINDOW]
+    if args.windows is not None:
+        windows.extend(load_windows(args.windows))
+    names = [window['name'] for window in windows]
+    if len(set(names)) != len(names):
+        raise ValueError("Event window names must be unique and may not be '{}'".format(SPEEDTEST_WINDOW['name']))
+
+    with report.stage('load archive'):
+        logging.info("Loading parsed data from disk...")
+        measured_fps = load_data('speedtest.measured')
+        tor_archive = TorArchive('tor.archive') # from 2019-08-01 to 2019-08-21
+        measured = lookup_fingerprints(tor_archive.fingerprints, measured_fps)
+        is_measured = numpy.zeros(len(tor_archive), dtype=bool)
+        is_measured[measured[measured >= 0]] = True
+        logging.info("done.")
+
+    with report.stage('process relays', unit='relays', count=len(tor_archive)):
+        logging.info("Processing data for {} event window(s)...".format(len(windows)))
+
+        advbw_over_time = AdvBwSeries(tor_archive.cons_times, ['measured', 'unmeasured'])
+        # the ids of the relays with results in each window, and their results
+        diffs = {window['name']: ([], []) for window in windows}
+
+        # workers map the archive themselves and only receive relay index ranges
+        for (range_diffs, range_totals) in map_relay_ranges(tor_archive, partial(process_relay_range, windows, is_measured)):
+            for name in range_diffs:
+                diffs[name][0].extend(range_diffs[name][0])
+                diffs[name][1].extend(range_diffs[name][1])
+            advbw_over_time.add_totals(range_totals)
+
+    with report.stage('save outputs'):
+        for window in windows:
+            relays, values = diffs[window['name']]
+            logging.info("Got results for {} relays in window '{}'.".format(len(relays), window['name']))
+            save_relay_data(tor_archive.fingerprints, relays, values, get_diffs_name(window['name']), args.format)
+        save_data(advbw_over_time.to_dict(), 'advbw_over_time', args.format)
 
     logging.info("All done!")
 
-def process_relay_data(params):
-    fp, relay_data, cons_times = params
-
-    if 'cons_timeline' not in relay_data or 'sdesc_timeline' not in relay_data:
-        return None
-
-    ct = relay_data['cons_timeline']
-    st = relay_data['sdesc_timeline']
+# the windows file holds a json list of event windows, each like
+# {"name": "round2", "min": "2019-08-13 00:00:00", "start": "2019-08-14 12:00:00", "stop": "2019-08-16 00:00:00"}
+def load_windows(filename):
+    windows = []
+    with open(filename, 'r') as inf:
+        for w in json.load(inf):
+            window = {'name': w['name']}
+            for key in ['min', 'start', 'stop']:
+                window[key] = datetime.strptime(w[key], "%Y-%m-%d %H:%M:%S").timestamp()
+            if not window['min'] <= window['start'] <= window['stop']:
+                raise ValueError("Event window '{}' must have min <= start <= stop".format(window['name']))
+            windows.append(window)
+    return windows
+
+def get_diffs_name(name):
+    if name == SPEEDTEST_WINDOW['name']:
+        return 'speedtest.diffs'
+    return 'speedtest.diffs.{}'.format(name)
+
+# this func is run by helper processes in process pool
+def process_relay_range(windows, is_measured, index_range):
+    tor_archive = get_worker_archive()
+
+    lo, hi = index_range
+    ct, st = tor_archive.cons_block(lo, hi), tor_archive.sdesc_block(lo, hi)
 
     #####
-    ##### first compute differences between before and after speedtest
+    ##### first compute differences before and after each event
     #####
 
-    weights_before = [float(ct[k]) for k in ct if float(k) > MIN and float(k) <= START]
-    weights_after = [float(ct[k]) for k in ct if float(k) > START and float(k) <= STOP]
-
-    advbws_before = [int(st[k]) for k in st if float(k) > MIN and float(k) <= START]
-    advbws_after = [int(st[k]) for k in st if float(k) > START and float(k) <= STOP]
-
-    w_before = mean(weights_before) if len(weights_before) > 0 else 0
-    w_after = mean(weights_after) if len(weights_after) > 0 else 0
-    a_before = max(advbws_before) if len(advbws_before) > 0 else 0
-    a_after = max(advbws_after) if len(advbws_after) > 0 else 0
-
-    if w_before == 0 or w_after == 0 or a_before == 0 or a_after == 0:
-        return None
-
-    speedtest = {
-        'weight': {
-            'before': w_before,
-            'after': w_after,
-        },
-        'advbw': {
-            'before': a_before,
-            'after': a_after,
-        },
-    }
+    # the first window is always the speed test window
+    diffs = {}
+    for (j, window) in enumerate(windows):
+        d = window_diffs(ct, st, hi-lo, window['min'], window['start'], window['stop'])
+        has_diffs = (d['weight_before'] != 0) & (d['weight_after'] != 0) & (d['advbw_before'] != 0) & (d['advbw_after'] != 0)
+
+        # the relay ids of the relays with differences, and their differences
+        relays = numpy.flatnonzero(has_diffs)
+        values = []
+        for i in relays:
+            values.append({
+                'weight': {
+                    'before': float(d['weight_before'][i]),
+                    'after': float(d['weight_after'][i]),
+                },
+                'advbw': {
+                    'before': int(d['advbw_before'][i]),
+                    'after': int(d['advbw_after'][i]),
+                },
+            })
+        diffs[window['name']] = ((lo + relays).tolist(), values)
+
+        if j == 0:
+            has_result = has_diffs
 
     #####
     ##### now compute total adv bandwidth overall
     #####
 
-    advbw_over_time = {ts: 0 for ts in cons_times}
+    advbw_over_time = AdvBwSeries(tor_archive.cons_times, ['measured', 'unmeasured'])
 
+    # only count relays for which we computed the speedtest differences, and
     # only count adv bw when the relay is in the consensus
-    for ts_str in ct:
-        cons_ts = float(ts_str)
-        advbw_over_time[cons_ts] += get_advbw(cons_ts, st)
-
-    return [fp, speedtest, advbw_over_time]
-
-def get_advbw(cons_ts, st):
-    # find the first sdesc published before the consensus
-    sdesc_times = sorted([float(ts_str) for ts_str in st], reverse=True)
-    for sdesc_ts in sdesc_times:
-        if sdesc_ts <= cons_ts:
-            return int(st[str(sdesc_ts)])
-    return 0
-
-def parallelize(worker_pool, func, work, batch_size=10000):
-    all_results = []
-    work_batches = [work[i:i+batch_size] for i in range(0, len(work), batch_size)]
-
-    logging.info("Parallelizing {} work tasks in {} batch(es)".format(len(work), len(work_batches)))
-
-    for i, work_batch in enumerate(work_batches):
-        try:
-            logging.info("Running batch {}/{}".format(i+1, len(work_batches)))
-            results = worker_pool.map(func, work_batch)
-            all_results.extend(results)
-        except KeyboardInterrupt:
-            print >> sys.stderr, "interrupted, terminating process pool"
-            worker_pool.terminate()
-            worker_pool.join()
-            sys.exit(1)
-
-    return all_results
-
-def setup_logging(logfilename):
-    file_handler = logging.FileHandler(filename=logfilename)
-    stdout_handler = logging.StreamHandler(sys.stdout)
-
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s %(created)f [processor] [%(levelname)s] %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S',
-        handlers=[file_handler, stdout_handler],
-    )
-
-    logging.info("Logging system initialized! Logging events to stdout and to '{}'".format(logfilename))
+    relay_groups = numpy.where(has_result, numpy.where(is_measured[lo:hi], 0, 1), -1)
+    advbw_over_time.add_block(ct, st, get_relay_groups(relay_groups, ct))
+
+    return diffs, advbw_over_time.totals
 
 def get_args():
     parser = ArgumentParser(
             description='Process capacity data produced with parse_tor_archive.py',
             formatter_class=CustomHelpFormatter)
 
+    parser.add_argument('-w', '--windows', help="Path to a json file listing additional event windows to compare relays before and after, each stored in speedtest.diffs.<name>.<FORMAT>", metavar="PATH", default=None)
+    parser.add_argument('-f', '--format', help="Format to store the outputs in; npz files are faster to write and load than json.xz files", choices=FORMATS, default=DEFAULT_FORMAT)
     parser.add_argument('-l', '--logfile', help="Name of the file to store log output in addition to stdout", metavar="PATH", default="processor.log")
+    parser.add_argument('-t', '--timing-report', help="Name of the file to store a json report of the time, throughput, and memory usage of each stage in", metavar="PATH", default="processor.timing.json")
 
     args = parser.parse_args()
     return args
 
-class CustomHelpFormatter(ArgumentDefaultsHelpFormatter):
-    # adds the 'RawDescriptionHelpFormatter' to the ArgsDefault one
-    def _fill_text(self, text, width, indent):
-        return ''.join([indent + line for line in text.splitlines(True)])
-
 if __name__ == "__main__":
     sys.exit(main())
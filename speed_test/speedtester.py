@@ -7,8 +7,10 @@ import time
 import datetime
 import logging
 import json
-
-from threading import Lock
+import math
+import struct
+import sqlite3
+import asyncio
 
 from functools import partial
 
@@ -39,7 +41,6 @@ https://github.com/robgjansen/tor/tree/research/speedtest/v1-squashed
 STATE = {
     'round': 1,
     'num_measurements': 0,
-    'target_fp': '',
     'clients': {
         9090: {'helper': {'nickname': 'SpeedTest0', 'fingerprint': '70AB9FC42C2FE750B24EECD27F7C25139F01EB6C'}},
         9091: {'helper': {'nickname': 'SpeedTest1', 'fingerprint': '244FA0202C1C0614348A083CC30413C1CCBB76BC'}},
@@ -75,7 +76,72 @@ RELAY_BLACKLIST = set([])
 # Length of time to send a burst of traffic through each relay, in seconds.
 SPEEDTEST_LENGTH = 20
 
-EVENT_LOCK = Lock()
+# With --adaptive-length, each burst instead lasts until the throughput that
+# the clients report in their BW events stops growing: once it has grown by
+# less than PLATEAU_GROWTH from one PLATEAU_SECONDS window to the next, after at
+# least SPEEDTEST_MIN_LENGTH seconds. Relays that are still ramping up (usually
+# the high-capacity ones) get up to SPEEDTEST_MAX_LENGTH seconds.
+ADAPTIVE_LENGTH = False
+SPEEDTEST_MIN_LENGTH = 10
+SPEEDTEST_MAX_LENGTH = 60
+PLATEAU_SECONDS = 3
+PLATEAU_GROWTH = 0.05
+
+# Seconds a client may wait in a status before we give up on the measurement,
+# and before we give up on the client's circuit and force it back to IDLE.
+STATUS_TIMEOUT = 25.0
+IDLE_TIMEOUT = 30.0
+
+# Seconds between reloading the consensus and flushing the BW log.
+HEARTBEAT_INTERVAL = 60.0
+
+# The round, the number of measurements, and the relays in STATE are journaled
+# in an SQLite database in WAL mode (see --statepath): each measurement or
+# timeout updates just its relay's row, a crash loses at most the last few
+# updates rather than corrupting the state, and a restart reads the rows back
+# without parsing the whole state. The clients are not stored in the
+# database, they are configured above. A JSON copy of the whole state in the
+# old format, including the clients and their last status, is written on
+# shutdown (see --jsonpath).
+STATE_DB = None
+
+# The event loop that drives the speed test. stem delivers controller events on
+# its own threads, which hand them to the loop; STATE is only touched from the
+# loop, so no locking is needed.
+LOOP = None
+
+# The timeout timer of each client, restarted whenever its status changes.
+TIMERS = {}
+
+# The relays left to measure in this round; the next target is popped from the end.
+TARGETS = []
+
+# Every BW event of the clients taking part in a measurement is appended to the
+# BW log (see --bwlogpath) as a fixed-size little-endian record of the time,
+# the client's control port and circuit id, the bytes read and written in the
+# past second, and the target's fingerprint as 20 raw bytes. The log starts
+# with BW_LOG_MAGIC; parse_bw_log.py reads it.
+BW_LOG_MAGIC = b'SPDTBW01'
+BW_RECORD = struct.Struct('<dHIQQ20s')
+BW_LOG = None
+
+# The measurements in progress, keyed by target fingerprint: the target, the
+# clients measuring it, the length of the burst, the bytes each client has
+# transferred in each second of the burst, and whether the burst is done (all
+# clients STOPPED), after which the clients are only closing their circuits.
+# Each client takes part in at most one measurement.
+MEASUREMENTS = {}
+CLIENT_MEASUREMENTS = {}
+
+# The capacity of each client and its helper relay, in the units of consensus
+# bandwidth (KB/s). When set (with --client-capacity), targets are measured in
+# parallel, each by a group of just enough clients to send it CAPACITY_HEADROOM
+# times its capacity (see get_capacity); otherwise every target is measured by
+# all of the clients in turn.
+CLIENT_CAPACITY = None
+# Consensus weights often underestimate what a relay can do, which is what the
+# speed test is meant to discover.
+CAPACITY_HEADROOM = 4.0
 
 def main():
     # construct the options
@@ -89,23 +155,49 @@ def main():
         dest="logpath", default="{}/{}".format(os.getcwd(), "speedtester.log"))
 
     parser.add_argument('-s', '--statepath',
-        help="""a STRING path to store speedtest state""",
+        help="""a STRING path to the SQLite database that stores the speedtest state""",
+        action="store", type=str, metavar="STRING",
+        dest="statepath", default="{}/{}".format(os.getcwd(), "speedtester.state.db"))
+
+    parser.add_argument('-j', '--jsonpath',
+        help="""a STRING path to write the speedtest state to as JSON on shutdown; when the
+state database holds no state yet, the state is first imported from this file""",
+        action="store", type=str, metavar="STRING",
+        dest="jsonpath", default="{}/{}".format(os.getcwd(), "speedtester.state"))
+
+    parser.add_argument('-b', '--bwlogpath',
+        help="""a STRING path to append the per-second BW events of the speed tests to""",
         action="store", type=str, metavar="STRING",
-        dest="statepath", default="{}/{}".format(os.getcwd(), "speedtester.state"))
+        dest="bwlogpath", default="{}/{}".format(os.getcwd(), "speedtester.bw.log"))
+
+    parser.add_argument('-c', '--client-capacity',
+        help="""a FLOAT capacity of each client and helper relay pair in KB/s (like
+consensus bandwidth); if given, multiple targets are measured at once by groups
+of clients sized to the targets' capacity""",
+        action="store", type=float, metavar="FLOAT",
+        dest="client_capacity", default=None)
+
+    parser.add_argument('-a', '--adaptive-length',
+        help="""stop each speed test once the throughput stops growing, rather than after
+a fixed {} seconds""".format(SPEEDTEST_LENGTH),
+        action="store_true", dest="adaptive_length", default=False)
 
     args = parser.parse_args()
     args.statepath = os.path.abspath(os.path.expanduser(args.statepath))
+    args.jsonpath = os.path.abspath(os.path.expanduser(args.jsonpath))
     args.logpath = os.path.abspath(os.path.expanduser(args.logpath))
+    args.bwlogpath = os.path.abspath(os.path.expanduser(args.bwlogpath))
     setup_logging(args.logpath)
     run(args)
 
 def run(args):
-    global STATE
-    if os.path.exists(args.statepath):
-        with open(args.statepath, 'r') as statefile:
-            STATE = json.load(statefile)
+    global LOOP, CLIENT_CAPACITY, ADAPTIVE_LENGTH, BW_LOG
+    init_state(args.statepath, args.jsonpath)
 
-    STATE['target_fp'] = ''
+    LOOP = asyncio.get_event_loop()
+    CLIENT_CAPACITY = args.client_capacity
+    ADAPTIVE_LENGTH = args.adaptive_length
+    BW_LOG = open_bw_log(args.bwlogpath)
 
     logging.info("Starting control of {} Tor clients".format(len(STATE['clients'])))
     for ctrl_port in STATE['clients']:
@@ -113,26 +205,17 @@ def run(args):
         STATE['clients'][ctrl_port]['circid'] = 0
         setup_controller(ctrl_port)
 
-    # let stem run its threads and log all of the events, until user interrupts
+    # the clients advance as their events arrive, until user interrupts
+    heartbeat_task = LOOP.create_task(heartbeat())
     try:
-        while True:
-            EVENT_LOCK.acquire()
-            targets, num_total = get_relays(args)
-            EVENT_LOCK.release()
-
-            msg = "heartbeat: performed {} measurements, {}/{} relays remain in round {}, press CTRL-C to quit".format(STATE['num_measurements'], len(targets), num_total, STATE['round'])
-
-            logging.info(msg)
-
-            endtime = time.time() + 60.0
-            while time.time() < endtime:
-                EVENT_LOCK.acquire()
-                run_one_second_loop(targets)
-                EVENT_LOCK.release()
-                time.sleep(1)
+        LOOP.run_until_complete(heartbeat_task)
     except KeyboardInterrupt:
         logging.info("Caught a KeyboardInterrupt from user")
-        pass  # the user hit ctrl+c
+        heartbeat_task.cancel()  # the user hit ctrl+c
+        try:
+            LOOP.run_until_complete(heartbeat_task)
+        except asyncio.CancelledError:
+            pass
 
     logging.info("Shutting down {} controllers...".format(len(STATE['clients'])))
     for ctrl_port in STATE['clients']:
@@ -144,76 +227,167 @@ def run(args):
             elif status != "CLOSING" and status != "CLOSED":
                 send_close(ctrl_port)
         shutdown_controller(ctrl_port)
-    get_relays(args)
+    export_state(args.jsonpath)
+    STATE_DB.close()
+    BW_LOG.close()
+    LOOP.close()
     logging.info("Done, goodbye!")
 
-def run_one_second_loop(targets):
+async def heartbeat():
+    global TARGETS
+    while True:
+        TARGETS, num_total = get_relays()
+
+        msg = "heartbeat: performed {} measurements ({} in progress), {}/{} relays remain in round {}, press CTRL-C to quit".format(STATE['num_measurements'], len(MEASUREMENTS), len(TARGETS), num_total, STATE['round'])
+
+        logging.info(msg)
+
+        # the clients sit idle when they run out of targets until we get more
+        schedule()
+        BW_LOG.flush()
+
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+# starts measuring the next targets for as long as there are enough idle clients
+# to measure them; the targets are started in order, so that big targets are
+# not held up by smaller ones that need fewer clients
+def schedule():
+    idle_ctrl_ports = [ctrl_port for ctrl_port in STATE['clients'] if ctrl_port not in CLIENT_MEASUREMENTS]
+    while len(TARGETS) > 0:
+        n_clients = get_num_clients(TARGETS[-1])
+        if n_clients > len(idle_ctrl_ports):
+            break
+        start_measurement(TARGETS.pop(), idle_ctrl_ports[:n_clients])
+        idle_ctrl_ports = idle_ctrl_ports[n_clients:]
+
+def get_num_clients(target_fp):
     n_clients = len(STATE['clients'])
-    status_counts, str_counts = count_status()
-    logging.info("Client status counts: {}".format(str_counts))
+    if CLIENT_CAPACITY is None or target_fp not in STATE['relays']:
+        return n_clients
+    needed = get_capacity(target_fp) * CAPACITY_HEADROOM / CLIENT_CAPACITY
+    return max(1, min(n_clients, int(math.ceil(needed))))
+
+# the relay's consensus bandwidth, or the throughput we reached in our last
+# measurement of it if that was higher, in KB/s
+def get_capacity(fp):
+    return max(float(STATE['relays'][fp]['bandwidth']), float(STATE['relays'][fp].get('capacity', 0)))
+
+def start_measurement(target_fp, ctrl_ports):
+    length = SPEEDTEST_MAX_LENGTH if ADAPTIVE_LENGTH else SPEEDTEST_LENGTH
+    measurement = {'target_fp': target_fp, 'ctrl_ports': ctrl_ports, 'timed_out': False, 'done': False,
+        'length': length, 'bytes': {ctrl_port: [] for ctrl_port in ctrl_ports}}
+    MEASUREMENTS[target_fp] = measurement
+    for ctrl_port in ctrl_ports:
+        CLIENT_MEASUREMENTS[ctrl_port] = measurement
+
+    logging.info("{}: sending open to {} clients now".format(target_fp, len(ctrl_ports)))
+    for ctrl_port in ctrl_ports:
+        send_open(ctrl_port, target_fp)
+
+def finish_measurement(measurement):
+    MEASUREMENTS.pop(measurement['target_fp'])
+    for ctrl_port in measurement['ctrl_ports']:
+        CLIENT_MEASUREMENTS.pop(ctrl_port)
+
+# moves the measurement on as soon as all of its clients reach the same status;
+# called whenever the status of one of its clients changes
+def advance(measurement):
+    target_fp, ctrl_ports = measurement['target_fp'], measurement['ctrl_ports']
+    n_clients = len(ctrl_ports)
+    status_counts, str_counts = count_status(ctrl_ports)
+    logging.info("{}: client status counts: {}".format(target_fp, str_counts))
 
     if status_counts['IDLE'] + status_counts['CLOSED'] == n_clients:
-        logging.info("All clients are IDLE!")
-        if len(targets) > 0:
-            logging.info("Sending open to {} clients now".format(len(STATE['clients'])))
-            STATE['target_fp'] = targets.pop()
-            for ctrl_port in STATE['clients']:
-                send_open(ctrl_port, STATE['target_fp'])
+        logging.info("{}: all clients are IDLE!".format(target_fp))
+        finish_measurement(measurement)
+        schedule()
 
     elif status_counts['OPENED'] == n_clients:
-        logging.info("All clients are OPENED!")
-        logging.info("Sending start to {} clients now".format(len(STATE['clients'])))
-        for ctrl_port in STATE['clients']:
-            send_start(ctrl_port, SPEEDTEST_LENGTH)
+        logging.info("{}: all clients are OPENED!".format(target_fp))
+        logging.info("{}: sending start to {} clients now".format(target_fp, n_clients))
+        for ctrl_port in ctrl_ports:
+            send_start(ctrl_port, measurement['length'])
 
     elif status_counts['STARTED'] == n_clients:
-        logging.info("All clients are STARTED!")
+        logging.info("{}: all clients are STARTED!".format(target_fp))
 
     elif status_counts['STOPPED'] == n_clients:
-        logging.info("All clients are STOPPED!")
-        logging.info("Sending close to {} clients now".format(len(STATE['clients'])))
-        for ctrl_port in STATE['clients']:
+        if measurement['done']:
+            return
+        logging.info("{}: all clients are STOPPED!".format(target_fp))
+        logging.info("{}: sending close to {} clients now".format(target_fp, n_clients))
+        for ctrl_port in ctrl_ports:
             send_close(ctrl_port)
+        measurement['done'] = True
         STATE['num_measurements'] += 1
-        if STATE['target_fp'] in STATE['relays']:
-            fp = STATE['target_fp']
-            STATE['relays'][fp]['n_measured'] = int(STATE['relays'][fp]['n_measured']) + 1
-        STATE['target_fp'] = ''
-
-    elif status_counts['CLOSED'] == n_clients:
-        logging.info("All clients are CLOSED!")
-        for ctrl_port in STATE['clients']:
-            if 'circid' in STATE['clients'][ctrl_port]:
-                STATE['clients'][ctrl_port]['circid'] = 0
-            set_status(ctrl_port, 'IDLE')
+        if not measurement['timed_out'] and target_fp in STATE['relays']:
+            STATE['relays'][target_fp]['n_measured'] = int(STATE['relays'][target_fp]['n_measured']) + 1
+        BW_LOG.flush()
+        throughput = get_throughput(measurement)
+        if len(throughput) > 0 and target_fp in STATE['relays']:
+            STATE['relays'][target_fp]['capacity'] = max(throughput) / 1000.0
+            logging.info("{}: reached {} KB/s in {} seconds".format(target_fp, STATE['relays'][target_fp]['capacity'], len(throughput)))
+        save_state([target_fp] if target_fp in STATE['relays'] else [])
+
+# the total bytes transferred by the measurement's clients in each second of the
+# burst, as far as all of them have reported
+def get_throughput(measurement):
+    return [sum(seconds) for seconds in zip(*measurement['bytes'].values())]
+
+# stops the burst early once the throughput has stopped growing
+def check_plateau(measurement):
+    throughput = get_throughput(measurement)
+    if len(throughput) < max(SPEEDTEST_MIN_LENGTH, 2*PLATEAU_SECONDS):
+        return
+    recent = sum(throughput[-PLATEAU_SECONDS:])
+    previous = sum(throughput[-2*PLATEAU_SECONDS:-PLATEAU_SECONDS])
+    if recent > previous * (1.0 + PLATEAU_GROWTH):
+        return
 
+    ctrl_ports = [ctrl_port for ctrl_port in measurement['ctrl_ports'] if STATE['clients'][ctrl_port]['status'] == 'STARTED']
+    if len(ctrl_ports) > 0:
+        logging.info("{}: throughput plateaued after {} seconds, sending stop to {} clients now".format(measurement['target_fp'], len(throughput), len(ctrl_ports)))
+    for ctrl_port in ctrl_ports:
+        send_stop(ctrl_port)
+
+# called when a client has waited STATUS_TIMEOUT seconds in its status
+def on_status_timeout(ctrl_port):
+    status = STATE['clients'][ctrl_port]['status']
+    circid = int(STATE['clients'][ctrl_port]['circid'])
+    logging.info("{}: timed out while {}".format(ctrl_port, status))
+
+    if circid > 0:
+        if status == 'STARTING' or status == "STARTED":
+            send_stop(ctrl_port)
+        elif status != 'CLOSING' and status != "CLOSED":
+            send_close(ctrl_port)
+        else:
+            TIMERS[ctrl_port] = LOOP.call_later(IDLE_TIMEOUT - STATUS_TIMEOUT, on_idle_timeout, ctrl_port)
     else:
-        target_fp = STATE['target_fp']
-        now = time.time()
-        did_timeout = False
-        for ctrl_port in STATE['clients']:
-            status = STATE['clients'][ctrl_port]['status']
-            status_ts = float(STATE['clients'][ctrl_port]['status_ts'])
-            circid = int(STATE['clients'][ctrl_port]['circid'])
-            if now - status_ts > 30.0:
-                set_status(ctrl_port, 'IDLE')
-                STATE['clients'][ctrl_port]['circid'] = 0
-            elif now - status_ts > 25.0:
-                did_timeout = True
-                if circid > 0:
-                    if status == 'STARTING' or status == "STARTED":
-                        send_stop(ctrl_port)
-                    elif status != 'CLOSING' and status != "CLOSED":
-                        send_close(ctrl_port)
-                else:
-                    set_status(ctrl_port, 'IDLE')
-        if did_timeout and target_fp in STATE['relays']:
-            STATE['relays'][target_fp]['n_timeouts'] = int(STATE['relays'][target_fp]['n_timeouts']) + 1
-            STATE['target_fp'] = ''
-
-def count_status():
+        set_status(ctrl_port, 'IDLE')
+
+    measurement = CLIENT_MEASUREMENTS.get(ctrl_port)
+    if measurement is not None:
+        # a client that is slow to close its circuit does not undo a finished measurement
+        if not measurement['timed_out'] and not measurement['done']:
+            measurement['timed_out'] = True
+            target_fp = measurement['target_fp']
+            if target_fp in STATE['relays']:
+                STATE['relays'][target_fp]['n_timeouts'] = int(STATE['relays'][target_fp]['n_timeouts']) + 1
+                save_state([target_fp])
+        advance(measurement)
+
+# called when a client has waited IDLE_TIMEOUT seconds for its circuit to close
+def on_idle_timeout(ctrl_port):
+    logging.info("{}: giving up on circuit {}".format(ctrl_port, STATE['clients'][ctrl_port]['circid']))
+    set_status(ctrl_port, 'IDLE')
+    STATE['clients'][ctrl_port]['circid'] = 0
+    if ctrl_port in CLIENT_MEASUREMENTS:
+        advance(CLIENT_MEASUREMENTS[ctrl_port])
+
+def count_status(ctrl_ports):
     counts = {'IDLE':0, 'OPENING':0, 'OPENED':0, 'STARTING':0, 'STARTED':0, 'STOPPING':0, 'STOPPED':0, 'CLOSING':0, 'CLOSED':0}
-    for ctrl_port in STATE['clients']:
+    for ctrl_port in ctrl_ports:
         status = STATE['clients'][ctrl_port]['status']
         counts.setdefault(status, 0)
         counts[status] += 1
@@ -223,10 +397,18 @@ def count_status():
             str_counts[c] = counts[c]
     return counts, str_counts
 
-def set_status(ctrl_port, status):
+def set_status(ctrl_port, status, timeout=None):
+    if timeout is None:
+        timeout = STATUS_TIMEOUT
     STATE['clients'][ctrl_port]['status'] = status
     STATE['clients'][ctrl_port]['status_ts'] = time.time()
 
+    # restart the client's timeout, unless it is waiting for a new target
+    if ctrl_port in TIMERS:
+        TIMERS.pop(ctrl_port).cancel()
+    if status != 'IDLE' and LOOP is not None and LOOP.is_running():
+        TIMERS[ctrl_port] = LOOP.call_later(timeout, on_status_timeout, ctrl_port)
+
 def send_stop(ctrl_port):
     msg = "SPEEDTEST STOP {}".format(STATE['clients'][ctrl_port]['circid'])
     send_message(ctrl_port, msg)
@@ -253,10 +435,11 @@ def send_message(ctrl_port, msg):
     CONTROLLERS[ctrl_port].get_socket().send(msg)
     logging.info("{}: command '{}'".format(ctrl_port, msg))
 
-def get_relays(args):
+def get_relays():
     logging.info("Getting relay information from cached consensus")
 
     current_relays = set()
+    changed_relays = []
     for desc in parse_file('/home/rjansen/run/speedtest0/cached-consensus'):
         nn, fp, bw = desc.nickname, desc.fingerprint, desc.bandwidth
         if len(TEST_TARGET_RELAYS) > 0 and fp not in TEST_TARGET_RELAYS: continue
@@ -264,26 +447,26 @@ def get_relays(args):
         current_relays.add(fp)
         if fp not in STATE['relays']:
             STATE['relays'][fp] = {'n_measured': 0, 'n_timeouts':0, 'nickname': nn, 'bandwidth': bw}
-        else:
+            changed_relays.append(fp)
+        elif STATE['relays'][fp]['bandwidth'] != bw:
             STATE['relays'][fp]['bandwidth'] = bw
+            changed_relays.append(fp)
+    save_state(changed_relays)
 
     targets = {}
     for fp in current_relays:
         n_tries = int(STATE['relays'][fp]['n_measured']) + int(STATE['relays'][fp]['n_timeouts'])
-        if n_tries < int(STATE['round']) and fp != STATE['target_fp']:
-            targets[fp] = STATE['relays'][fp]['bandwidth']
+        if n_tries < int(STATE['round']) and fp not in MEASUREMENTS:
+            targets[fp] = get_capacity(fp)
 
     if len(targets) <= 0:
         # we tried everyone once. go back and retry the timeouts
         for fp in current_relays:
-            if int(STATE['relays'][fp]['n_measured']) < int(STATE['round']):
-                targets[fp] = STATE['relays'][fp]['bandwidth']
+            if int(STATE['relays'][fp]['n_measured']) < int(STATE['round']) and fp not in MEASUREMENTS:
+                targets[fp] = get_capacity(fp)
 
     num_total = len(current_relays)
 
-    with open(args.statepath, 'w') as statefile:
-        json.dump(STATE, statefile, indent=2)
-
     sorted_target_fps = [item[0] for item in sorted(targets.items(), key=lambda kv: kv[1])]
 
     return sorted_target_fps, num_total
@@ -310,17 +493,30 @@ def setup_controller(ctrl_port):
         logging.error("event 'SPEEDTEST' is not recognized by tor, cannot continue")
         return
 
+# stem calls this from its event threads
 def __handle_async_event(ctrl_port, event):
-    EVENT_LOCK.acquire()
     event_str = event.raw_content().rstrip('\r\n')
+    LOOP.call_soon_threadsafe(handle_event, ctrl_port, event_str)
+
+def handle_event(ctrl_port, event_str):
     msg = "{}: {}".format(ctrl_port, event_str)
 
     logging.info(msg)
 
     parts = event_str.split()
     if parts[0] == "650":
-        if parts[1] == "SPEEDTEST":
+        if parts[1] == "BW":
+            measurement = CLIENT_MEASUREMENTS.get(ctrl_port)
+            if measurement is not None:
+                log_bw(ctrl_port, measurement['target_fp'], int(parts[2]), int(parts[3]))
+            if measurement is not None and STATE['clients'][ctrl_port]['status'] == 'STARTED':
+                measurement['bytes'][ctrl_port].append(int(parts[2]) + int(parts[3]))
+                if ADAPTIVE_LENGTH:
+                    check_plateau(measurement)
+
+        elif parts[1] == "SPEEDTEST":
             circid = int(parts[3])
+            status = STATE['clients'][ctrl_port]['status']
 
             if parts[2] == "OPENED":
                 if STATE['clients'][ctrl_port]['status'] == 'OPENING':
@@ -328,15 +524,109 @@ def __handle_async_event(ctrl_port, event):
                     STATE['clients'][ctrl_port]['circid'] = circid
             elif parts[2] == "STARTED":
                 if circid == int(STATE['clients'][ctrl_port]['circid']):
-                    set_status(ctrl_port, 'STARTED')
+                    # the burst itself takes up to the measurement's length
+                    length = CLIENT_MEASUREMENTS[ctrl_port]['length'] if ctrl_port in CLIENT_MEASUREMENTS else SPEEDTEST_LENGTH
+                    set_status(ctrl_port, 'STARTED', timeout=STATUS_TIMEOUT + length - SPEEDTEST_LENGTH)
             elif parts[2] == "STOPPED":
-                if circid == int(STATE['clients'][ctrl_port]['circid']):
+                # a late or duplicate STOPPED must not reopen a burst that is already closing
+                if circid == int(STATE['clients'][ctrl_port]['circid']) and status in ('STARTING', 'STARTED', 'STOPPING'):
                     set_status(ctrl_port, 'STOPPED')
             elif parts[2] == "CLOSED":
                 if circid == int(STATE['clients'][ctrl_port]['circid']):
                     set_status(ctrl_port, 'CLOSED')
                     STATE['clients'][ctrl_port]['circid'] = 0
-    EVENT_LOCK.release()
+
+            # advance the measurement the moment the client's status changes
+            if STATE['clients'][ctrl_port]['status'] != status and ctrl_port in CLIENT_MEASUREMENTS:
+                advance(CLIENT_MEASUREMENTS[ctrl_port])
+
+def open_state_db(path):
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    # in WAL mode, this still keeps the database consistent across crashes
+    db.execute("PRAGMA synchronous=NORMAL")
+    with db:
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        db.execute("CREATE TABLE IF NOT EXISTS relays (fp TEXT PRIMARY KEY, nickname TEXT, bandwidth INTEGER, n_measured INTEGER, n_timeouts INTEGER, capacity REAL)")
+    return db
+
+# opens the state database and loads the state from it, or imports the JSON
+# state if the database holds no state yet
+def init_state(statepath, jsonpath):
+    global STATE_DB
+    STATE_DB = open_state_db(statepath)
+    if is_state_db_empty() and os.path.exists(jsonpath):
+        import_state(jsonpath)
+    else:
+        load_state()
+
+# the database file exists before anything is written to it, so we check its
+# tables instead; an import that was interrupted left them empty (see save_state)
+def is_state_db_empty():
+    num_meta = STATE_DB.execute("SELECT COUNT(*) FROM meta").fetchone()[0]
+    num_relays = STATE_DB.execute("SELECT COUNT(*) FROM relays").fetchone()[0]
+    return num_meta == 0 and num_relays == 0
+
+def load_state():
+    for (key, value) in STATE_DB.execute("SELECT key, value FROM meta"):
+        STATE[key] = value
+    for (fp, nn, bw, n_measured, n_timeouts, capacity) in STATE_DB.execute("SELECT fp, nickname, bandwidth, n_measured, n_timeouts, capacity FROM relays"):
+        STATE['relays'][fp] = {'n_measured': n_measured, 'n_timeouts': n_timeouts, 'nickname': nn, 'bandwidth': bw}
+        if capacity is not None:
+            STATE['relays'][fp]['capacity'] = capacity
+    logging.info("Loaded the state of {} relays in round {}".format(len(STATE['relays']), STATE['round']))
+
+# writes the counters and the given relays to the state database in a single
+# transaction
+def save_state(fps):
+    with STATE_DB:
+        STATE_DB.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [('round', int(STATE['round'])), ('num_measurements', int(STATE['num_measurements']))])
+        STATE_DB.executemany("INSERT OR REPLACE INTO relays (fp, nickname, bandwidth, n_measured, n_timeouts, capacity) VALUES (?, ?, ?, ?, ?, ?)",
+            [(fp, STATE['relays'][fp]['nickname'], STATE['relays'][fp]['bandwidth'], int(STATE['relays'][fp]['n_measured']),
+                int(STATE['relays'][fp]['n_timeouts']), STATE['relays'][fp].get('capacity')) for fp in fps])
+
+# imports the round, the number of measurements, and the relays of a state
+# written by earlier versions of this script, or by export_state, in a single
+# transaction; the clients are taken from the configuration above instead
+def import_state(path):
+    with open(path, 'r') as statefile:
+        state = json.load(statefile)
+    STATE['round'] = state['round']
+    STATE['num_measurements'] = state['num_measurements']
+    STATE['relays'] = state['relays']
+    save_state(list(STATE['relays'].keys()))
+    logging.info("Imported the state of {} relays in round {} from '{}'".format(len(STATE['relays']), STATE['round'], path))
+
+# writes the state as JSON, in the format parse_measured.py reads once compressed
+# into speedtester.json.xz; like that file, it includes the clients, with the
+# status and circuit they were left in, which import_state ignores
+def export_state(path):
+    with open(path + '.tmp', 'w') as statefile:
+        json.dump(STATE, statefile, indent=2)
+    os.replace(path + '.tmp', path)
+
+# opens the BW log for appending, dropping the partial record a crash may have
+# left at its end so that the records that follow stay aligned
+def open_bw_log(path):
+    if not os.path.exists(path) or os.path.getsize(path) < len(BW_LOG_MAGIC):
+        bw_log = open(path, 'wb')
+        bw_log.write(BW_LOG_MAGIC)
+        return bw_log
+
+    with open(path, 'rb') as bw_log:
+        if bw_log.read(len(BW_LOG_MAGIC)) != BW_LOG_MAGIC:
+            raise ValueError("'{}' is not a speed test BW log".format(path))
+    num_records = (os.path.getsize(path) - len(BW_LOG_MAGIC)) // BW_RECORD.size
+    bw_log = open(path, 'r+b')
+    bw_log.truncate(len(BW_LOG_MAGIC) + num_records * BW_RECORD.size)
+    bw_log.seek(0, os.SEEK_END)
+    logging.info("Appending BW events to '{}' after {} existing records".format(path, num_records))
+    return bw_log
+
+def log_bw(ctrl_port, target_fp, read, written):
+    circid = int(STATE['clients'][ctrl_port]['circid'])
+    BW_LOG.write(BW_RECORD.pack(time.time(), int(ctrl_port), circid, read, written, bytes.fromhex(target_fp)))
 
 def setup_logging(logfilename):
     file_handler = logging.FileHandler(filename=logfilename)
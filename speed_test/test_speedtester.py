@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+# drives the speedtester's measurement state machine with SPEEDTEST events, as
+# if they came from the clients, and checks the counters it keeps per relay;
+# run with pytest
+
+import io
+import os
+import json
+import asyncio
+import importlib.util
+
+TARGET_FP = '0000000000000000000000000000000000000001'
+
+class FakeSocket(object):
+    def __init__(self):
+        self.messages = []
+
+    def send(self, msg):
+        self.messages.append(msg)
+
+class FakeController(object):
+    def __init__(self):
+        self.socket = FakeSocket()
+
+    def get_socket(self):
+        return self.socket
+
+# loads a fresh copy of the script, so that each test starts from its initial state
+def load_speedtester():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'speedtester.py')
+    spec = importlib.util.spec_from_file_location('speedtester', path)
+    st = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(st)
+
+    st.STATE['clients'] = {9090: {}, 9091: {}}
+    for ctrl_port in st.STATE['clients']:
+        st.STATE['clients'][ctrl_port] = {'helper': {'fingerprint': TARGET_FP}, 'status': 'IDLE', 'circid': 0}
+        st.CONTROLLERS[ctrl_port] = FakeController()
+    st.STATE['relays'][TARGET_FP] = {'n_measured': 0, 'n_timeouts': 0, 'nickname': 'target', 'bandwidth': 100}
+    st.STATE_DB = st.open_state_db(':memory:')
+    st.BW_LOG = io.BytesIO()
+    # the loop is not run, it only holds the timers the tests do not wait for
+    st.LOOP = asyncio.new_event_loop()
+    return st
+
+def send_events(st, status):
+    for (circid, ctrl_port) in enumerate(st.STATE['clients'], 1):
+        st.handle_event(ctrl_port, '650 SPEEDTEST {} {}'.format(status, circid))
+
+def get_saved_counters(st):
+    return st.STATE_DB.execute("SELECT n_measured, n_timeouts FROM relays WHERE fp = ?", (TARGET_FP,)).fetchone()
+
+def test_slow_close_after_measurement():
+    st = load_speedtester()
+    st.start_measurement(TARGET_FP, list(st.STATE['clients']))
+    for status in ['OPENED', 'STARTED', 'STOPPED']:
+        send_events(st, status)
+
+    # one client closes its circuit, the other waits in CLOSING until it times out
+    st.handle_event(9090, '650 SPEEDTEST CLOSED 1')
+    st.on_status_timeout(9091)
+
+    relay = st.STATE['relays'][TARGET_FP]
+    assert (relay['n_measured'], relay['n_timeouts']) == (1, 0)
+    assert get_saved_counters(st) == (1, 0)
+    assert st.STATE['num_measurements'] == 1
+    st.LOOP.close()
+
+def count_sent(st, ctrl_port, command):
+    return sum(1 for msg in st.CONTROLLERS[ctrl_port].get_socket().messages if msg.startswith('SPEEDTEST ' + command))
+
+def test_duplicate_stopped():
+    st = load_speedtester()
+    st.start_measurement(TARGET_FP, list(st.STATE['clients']))
+    for status in ['OPENED', 'STARTED', 'STOPPED']:
+        send_events(st, status)
+    assert [st.STATE['clients'][ctrl_port]['status'] for ctrl_port in st.STATE['clients']] == ['CLOSING', 'CLOSING']
+
+    # a late STOPPED does not put the closing clients back to STOPPED
+    send_events(st, 'STOPPED')
+
+    # and a measurement whose clients all end up STOPPED again is not counted again
+    for ctrl_port in st.STATE['clients']:
+        st.set_status(ctrl_port, 'STOPPED')
+    st.advance(st.MEASUREMENTS[TARGET_FP])
+
+    assert st.STATE['relays'][TARGET_FP]['n_measured'] == 1
+    assert get_saved_counters(st) == (1, 0)
+    assert st.STATE['num_measurements'] == 1
+    for ctrl_port in st.STATE['clients']:
+        assert count_sent(st, ctrl_port, 'CLOSE') == 1
+    st.LOOP.close()
+
+def test_adaptive_stop_crossing_stopped():
+    st = load_speedtester()
+    st.ADAPTIVE_LENGTH = True
+    st.start_measurement(TARGET_FP, list(st.STATE['clients']))
+    for status in ['OPENED', 'STARTED']:
+        send_events(st, status)
+
+    # the throughput is flat from the start, so the burst is stopped as soon
+    # as it has lasted SPEEDTEST_MIN_LENGTH seconds
+    for second in range(st.SPEEDTEST_MIN_LENGTH):
+        for ctrl_port in st.STATE['clients']:
+            st.handle_event(ctrl_port, '650 BW 1000 1000')
+    for ctrl_port in st.STATE['clients']:
+        assert count_sent(st, ctrl_port, 'STOP') == 1
+        assert st.STATE['clients'][ctrl_port]['status'] == 'STOPPING'
+
+    # the clients' own STOPPED crosses our STOP, so each reports STOPPED twice
+    send_events(st, 'STOPPED')
+    send_events(st, 'STOPPED')
+    send_events(st, 'CLOSED')
+
+    assert st.STATE['relays'][TARGET_FP]['n_measured'] == 1
+    assert st.STATE['relays'][TARGET_FP]['capacity'] == 4.0
+    assert get_saved_counters(st) == (1, 0)
+    assert st.STATE['num_measurements'] == 1
+    for ctrl_port in st.STATE['clients']:
+        assert count_sent(st, ctrl_port, 'CLOSE') == 1
+        assert st.STATE['clients'][ctrl_port]['status'] == 'CLOSED'
+    assert len(st.MEASUREMENTS) == 0
+    st.LOOP.close()
+
+def test_timeout_during_burst():
+    st = load_speedtester()
+    st.start_measurement(TARGET_FP, list(st.STATE['clients']))
+    for status in ['OPENED', 'STARTED']:
+        send_events(st, status)
+
+    # both clients time out while STARTED, and then stop
+    st.on_status_timeout(9090)
+    st.on_status_timeout(9091)
+    send_events(st, 'STOPPED')
+
+    relay = st.STATE['relays'][TARGET_FP]
+    assert (relay['n_measured'], relay['n_timeouts']) == (0, 1)
+    assert get_saved_counters(st) == (0, 1)
+    st.LOOP.close()
+
+def test_import_after_interrupted_import(tmp_path):
+    statepath, jsonpath = str(tmp_path / 'speedtester.state.db'), str(tmp_path / 'speedtester.state')
+    relays = {fp: {'n_measured': 1, 'n_timeouts': 0, 'nickname': 'relay', 'bandwidth': 100} for fp in ['A'*40, 'B'*40]}
+
+    # the import fails on the second relay, after the database file was created
+    broken = dict(relays, **{'B'*40: {'n_measured': 1}})
+    with open(jsonpath, 'w') as statefile:
+        json.dump({'round': 2, 'num_measurements': 2, 'relays': broken}, statefile)
+    st = load_speedtester()
+    try:
+        st.init_state(statepath, jsonpath)
+    except KeyError:
+        pass
+    st.STATE_DB.close()
+    assert os.path.exists(statepath)
+
+    # so the next start imports the state again
+    with open(jsonpath, 'w') as statefile:
+        json.dump({'round': 2, 'num_measurements': 2, 'relays': relays}, statefile)
+    st = load_speedtester()
+    st.STATE['relays'] = {}
+    st.init_state(statepath, jsonpath)
+    st.STATE_DB.close()
+
+    # and the start after that loads it from the database
+    st = load_speedtester()
+    st.STATE['relays'] = {}
+    os.remove(jsonpath)
+    st.init_state(statepath, jsonpath)
+    assert (st.STATE['round'], st.STATE['num_measurements']) == (2, 2)
+    assert st.STATE['relays'] == relays
+    st.STATE_DB.close()
+    st.LOOP.close()
@@ -0,0 +1 @@
+# shared code for the torbwest capacity variation and speed test pipelines
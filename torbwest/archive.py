@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+# Columnar on-disk format for the relay data extracted from collector
+# consensus and server descriptor files.
+#
+# An archive is a directory holding one .npy file per column plus a small
+# meta.json. Relays are identified by their position in the sorted
+# 'fingerprints' array. The cons_* and sdesc_* columns are flat arrays that
+# hold the timelines of all relays back to back, sorted by relay and then by
+# timestamp; relay i owns rows cons_offsets[i]:cons_offsets[i+1] of the cons_*
+# columns and rows sdesc_offsets[i]:sdesc_offsets[i+1] of the sdesc_* columns.
+#
+# The per-relay metrics (e.g., relay_rsds and relay_weights) sum the timelines
+# in this time order, while the original scripts summed them in the order
+# os.walk listed the files, so the last bits of some of the floats differ from
+# theirs; they match exactly once the original timelines are sorted by time.
+#
+# TorArchive memory-maps the columns by default, so per-relay timelines are
+# handed out as views into the page cache without copying. Worker processes
+# open their own map of the archive (see init_worker_archive) and receive only
+# relay index ranges from the parent (see map_relay_ranges).
+
+import os
+import json
+import math
+import logging
+
+from multiprocessing import Pool, cpu_count
+
+import numpy
+
+from torbwest.util import parallelize
+
+ARCHIVE_VERSION = 1
+
+# bits stored in the cons_flags column
+FLAG_UNMEASURED = 1
+FLAG_EXIT = 2
+FLAG_GUARD = 4
+
+COLUMNS = {
+    'fingerprints': 'U40',
+    'cons_times': 'float64',
+    'cons_offsets': 'int64',
+    'cons_ts': 'float64',
+    'cons_weight': 'float64',
+    'cons_flags': 'uint8',
+    'sdesc_offsets': 'int64',
+    'sdesc_ts': 'float64',
+    'adv_bw': 'int64',
+    'obs_bw': 'int64',
+    'avg_bw': 'int64',
+    'brst_bw': 'int64',
+}
+
+def encode_flags(isunmeasured, isexit, isguard):
+    flags = 0
+    if isunmeasured: flags |= FLAG_UNMEASURED
+    if isexit: flags |= FLAG_EXIT
+    if isguard: flags |= FLAG_GUARD
+    return flags
+
+# returns the fingerprints in sorted order, and an array that maps ids assigned
+# to them in order of appearance (fp_ids[fp]) onto positions in that order
+def sort_fingerprints(fp_ids):
+    fps = sorted(fp_ids.keys())
+    remap = numpy.zeros(len(fps), dtype='int32')
+    for rank, fp in enumerate(fps):
+        remap[fp_ids[fp]] = rank
+    return fps, remap
+
+# returns the relay id (position in the sorted fingerprints table) of each of
+# fps, or -1 for fingerprints that are not in the table
+def lookup_fingerprints(fingerprints, fps):
+    fps = numpy.asarray(fps, dtype=COLUMNS['fingerprints'])
+    if len(fingerprints) == 0:
+        return numpy.full(len(fps), -1, dtype='int32')
+    relays = numpy.minimum(numpy.searchsorted(fingerprints, fps), len(fingerprints)-1)
+    return numpy.where(numpy.asarray(fingerprints)[relays] == fps, relays, -1).astype('int32')
+
+# groups timeline rows by relay and sorts them by timestamp within each relay.
+# when a relay has multiple rows with the same timestamp, the one that appears
+# last is kept, as if the rows had been inserted into a dict keyed by timestamp.
+# returns the per-relay offsets and the order in which to take the rows.
+def group_rows(fp, ts, num_relays):
+    # lexsort is stable, so rows with equal keys stay in order of appearance
+    order = numpy.lexsort((ts, fp))
+    fp_sorted, ts_sorted = fp[order], ts[order]
+
+    keep = numpy.ones(len(order), dtype=bool)
+    keep[:-1] = (fp_sorted[1:] != fp_sorted[:-1]) | (ts_sorted[1:] != ts_sorted[:-1])
+
+    offsets = numpy.zeros(num_relays+1, dtype='int64')
+    numpy.cumsum(numpy.bincount(fp_sorted[keep], minlength=num_relays), out=offsets[1:])
+
+    return offsets, order[keep]
+
+# builds the archive columns from timeline rows; cons_rows and sdesc_rows map
+# the field names in CONS_FIELDS and SDESC_FIELDS plus 'fp' (the relay ids
+# assigned in fp_ids) onto lists or arrays of row values
+def build_columns(fp_ids, cons_times, cons_rows, sdesc_rows):
+    fps, remap = sort_fingerprints(fp_ids)
+
+    columns = {
+        'fingerprints': numpy.array(fps, dtype=COLUMNS['fingerprints']),
+        'cons_times': numpy.sort(numpy.array(cons_times, dtype=COLUMNS['cons_times'])),
+    }
+
+    for (kind, rows, fields) in [('cons', cons_rows, CONS_FIELDS), ('sdesc', sdesc_rows, SDESC_FIELDS)]:
+        fp = remap[numpy.asarray(rows['fp'], dtype='int32')]
+        ts = numpy.asarray(rows['ts'], dtype='float64')
+        offsets, order = group_rows(fp, ts, len(fps))
+        columns[kind + '_offsets'] = offsets
+        for (field, name) in fields.items():
+            columns[name] = numpy.asarray(rows[field], dtype=COLUMNS[name])[order]
+
+    return columns
+
+def save_columns(path, columns):
+    for name in COLUMNS:
+        save_column(path, name, columns[name])
+    save_meta(path, len(columns['fingerprints']), len(columns['cons_times']), len(columns['cons_ts']), len(columns['sdesc_ts']))
+
+def save_column(path, name, data):
+    os.makedirs(path, exist_ok=True)
+    numpy.save(os.path.join(path, name + '.npy'), numpy.asarray(data, dtype=COLUMNS[name]))
+
+def save_meta(path, num_relays, num_cons, num_cons_entries, num_sdesc_entries):
+    meta = {
+        'version': ARCHIVE_VERSION,
+        'num_relays': int(num_relays),
+        'num_cons': int(num_cons),
+        'num_cons_entries': int(num_cons_entries),
+        'num_sdesc_entries': int(num_sdesc_entries),
+    }
+    with open(os.path.join(path, 'meta.json'), 'w') as outf:
+        json.dump(meta, outf, indent=2)
+
+CONS_FIELDS = {'ts': 'cons_ts', 'weight': 'cons_weight', 'flags': 'cons_flags'}
+SDESC_FIELDS = {'ts': 'sdesc_ts', 'adv_bw': 'adv_bw', 'obs_bw': 'obs_bw', 'avg_bw': 'avg_bw', 'brst_bw': 'brst_bw'}
+
+class TorArchive(object):
+    def __init__(self, path, mmap_mode='r'):
+        self.path = os.path.abspath(os.path.expanduser(path))
+
+        with open(os.path.join(self.path, 'meta.json'), 'r') as inf:
+            self.meta = json.load(inf)
+        if self.meta['version'] != ARCHIVE_VERSION:
+            raise ValueError("Unsupported archive version {} in '{}'".format(self.meta['version'], self.path))
+
+        for name in COLUMNS:
+            setattr(self, name, numpy.load(os.path.join(self.path, name + '.npy'), mmap_mode=mmap_mode))
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def cons_range(self, i):
+        return int(self.cons_offsets[i]), int(self.cons_offsets[i+1])
+
+    def sdesc_range(self, i):
+        return int(self.sdesc_offsets[i]), int(self.sdesc_offsets[i+1])
+
+    # returns the relay's consensus timeline as zero-copy views of the columns
+    def cons_view(self, i):
+        lo, hi = self.cons_range(i)
+        return {field: getattr(self, name)[lo:hi] for (field, name) in CONS_FIELDS.items()}
+
+    # returns the relay's server descriptor timeline as zero-copy views of the columns
+    def sdesc_view(self, i):
+        lo, hi = self.sdesc_range(i)
+        return {field: getattr(self, name)[lo:hi] for (field, name) in SDESC_FIELDS.items()}
+
+    # like cons_view but covering the timelines of relays i to j-1, plus a
+    # 'relay' field holding the index (relative to i) of each row's relay
+    def cons_block(self, i, j):
+        return self._block(self.cons_offsets, CONS_FIELDS, i, j)
+
+    # like sdesc_view but covering the timelines of relays i to j-1, plus a
+    # 'relay' field holding the index (relative to i) of each row's relay
+    def sdesc_block(self, i, j):
+        return self._block(self.sdesc_offsets, SDESC_FIELDS, i, j)
+
+    def _block(self, offsets, fields, i, j):
+        lo, hi = int(offsets[i]), int(offsets[j])
+        block = {field: getattr(self, name)[lo:hi] for (field, name) in fields.items()}
+        block['relay'] = numpy.repeat(numpy.arange(j-i), numpy.diff(offsets[i:j+1]))
+        return block
+
+def get_index_ranges(num_relays, chunk_size):
+    return [(i, min(i+chunk_size, num_relays)) for i in range(0, num_relays, chunk_size)]
+
+# the archive opened by each helper process in a process pool
+WORKER_ARCHIVE = None
+
+# use as the initializer of a process pool, e.g.:
+# Pool(cpu_count(), initializer=init_worker_archive, initargs=(path,))
+def init_worker_archive(path):
+    global WORKER_ARCHIVE
+    WORKER_ARCHIVE = TorArchive(path)
+
+def get_worker_archive():
+    return WORKER_ARCHIVE
+
+# chunks per helper process: more chunks balance the load when some relays
+# have much longer timelines than others, fewer chunks amortize the per-task
+# overhead and let the block functions vectorize over more relays at once
+CHUNKS_PER_PROCESS = 8
+MIN_CHUNK_SIZE = 100
+MAX_CHUNK_SIZE = 10000
+
+def get_chunk_size(num_relays, num_processes):
+    chunk_size = math.ceil(num_relays / (num_processes * CHUNKS_PER_PROCESS))
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, chunk_size))
+
+# runs func(index_range) over ranges of the relays in the archive in a pool of
+# helper processes and returns the results in range order; each helper maps
+# the archive itself (see get_worker_archive), so the relay timelines are
+# shared through the page cache and only the ranges are sent to the helpers
+def map_relay_ranges(tor_archive, func, num_processes=None):
+    if num_processes is None:
+        num_processes = cpu_count()
+    chunk_size = get_chunk_size(len(tor_archive), num_processes)
+    work = get_index_ranges(len(tor_archive), chunk_size)
+    logging.info("Processing {} relays in {} ranges of up to {} relays with {} processes".format(len(tor_archive), len(work), chunk_size, num_processes))
+
+    worker_pool = Pool(num_processes, initializer=init_worker_archive, initargs=(tor_archive.path,))
+    results = parallelize(worker_pool, func, work)
+    worker_pool.close()
+    worker_pool.join()
+    return results
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+# Persistent cache of per-file parse results, so that re-parsing an archive
+# only processes the files that were added or changed since the last run.
+#
+# Entries are keyed by the kind of parse and the absolute path of the file, and
+# are only used while the file's size and modification time still match. The
+# cache is only accessed from the parent process; workers never touch it.
+
+import os
+import zlib
+import pickle
+import sqlite3
+
+class ParseCache(object):
+    def __init__(self, path):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS results (
+            kind TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            result BLOB NOT NULL,
+            PRIMARY KEY (kind, path))''')
+        self.db.commit()
+        self.num_pending = 0
+
+    # returns (True, result) on a hit and (False, None) on a miss
+    def get(self, kind, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.db.execute('SELECT size, mtime_ns, result FROM results WHERE kind=? AND path=?', (kind, path)).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return False, None
+        return True, pickle.loads(zlib.decompress(row[2]))
+
+    def put(self, kind, path, result):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        blob = zlib.compress(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)', (kind, path, stat.st_size, stat.st_mtime_ns, blob))
+
+        # commit in batches to avoid a disk sync per file
+        self.num_pending += 1
+        if self.num_pending >= 1000:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.num_pending = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+# Helpers for reading descriptors from collector archives, either as files
+# extracted from the monthly tarballs or straight out of the .tar.xz tarballs
+# themselves (e.g., consensuses-2019-08.tar.xz).
+
+import os
+import tarfile
+
+TARBALL_SUFFIXES = ('.tar', '.tar.xz', '.tar.gz', '.tar.bz2')
+
+def is_tarball(path):
+    return path.endswith(TARBALL_SUFFIXES)
+
+# path is a tarball, a single descriptor file, or a directory holding any mix
+# of tarballs and extracted descriptor files
+def get_input_paths(path):
+    file_paths, tarball_paths = [], []
+
+    if os.path.isfile(path):
+        (tarball_paths if is_tarball(path) else file_paths).append(path)
+        return file_paths, tarball_paths
+
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            file_path = os.path.join(root, filename)
+            (tarball_paths if is_tarball(file_path) else file_paths).append(file_path)
+
+    return file_paths, tarball_paths
+
+# yields the (name, contents) of each file in the tarball, decompressing it as
+# a stream so that nothing is extracted to the filesystem
+def iter_tarball(path):
+    with tarfile.open(path, 'r|*') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            member_file = tar.extractfile(member)
+            yield member.name, member_file.read()
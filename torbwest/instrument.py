@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+# Per-stage timing, throughput, worker utilization, memory, and output size
+# instrumentation for the pipeline scripts. A script starts a report, wraps
+# each of its stages in report.stage(), and saves the report as json when done:
+#
+#   report = start_report('parser')
+#   with report.stage('parse consensuses', unit='documents') as stage:
+#       ...
+#       stage['count'] = num_documents
+#   report.finish('parser.timing.json')
+#
+# parallelize and stream (see torbwest.util) add the time helper processes
+# spend in each task to the current stage, and save_json adds the size of the
+# files it writes.
+
+import os
+import sys
+import json
+import time
+import logging
+import resource
+
+from contextlib import contextmanager
+from multiprocessing import cpu_count
+
+# the report of the running script, if any
+REPORT = None
+
+def start_report(name, num_processes=None):
+    global REPORT
+    REPORT = RunReport(name, num_processes if num_processes is not None else cpu_count())
+    return REPORT
+
+def get_report():
+    return REPORT
+
+# this func is run by helper processes in process pool
+def timed_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+# ru_maxrss is in kilobytes on linux but in bytes on macos
+def get_peak_rss(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def get_size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(d, f)) for (d, _, files) in os.walk(path) for f in files)
+
+class RunReport(object):
+    def __init__(self, name, num_processes):
+        self.name = name
+        self.num_processes = num_processes
+        self.start_time = time.time()
+        self.stages = []
+        self.outputs = {}
+        self.current = None
+
+    @contextmanager
+    def stage(self, name, unit=None, count=None):
+        stage = {'name': name, 'unit': unit, 'count': count, 'worker_busy_time': 0.0, 'bytes_written': 0}
+        parent, self.current = self.current, stage
+        start = time.perf_counter()
+        start_peak_rss = get_peak_rss()
+        try:
+            yield stage
+        finally:
+            self.current = parent
+            stage['wall_time'] = time.perf_counter() - start
+            # ru_maxrss only ever grows, so this is how much the stage raised
+            # the peak of the run, which is 0 for stages that stay below it
+            stage['peak_rss_increase'] = get_peak_rss() - start_peak_rss
+            self.stages.append(stage)
+            self.log_stage(stage)
+
+    def log_stage(self, stage):
+        details = []
+        if stage['count'] is not None and stage['wall_time'] > 0:
+            details.append("{} {}, {:.1f} {}/s".format(stage['count'], stage['unit'], stage['count']/stage['wall_time'], stage['unit']))
+        if stage['worker_busy_time'] > 0:
+            details.append("{:.0f}% worker utilization".format(100.0*get_utilization(stage, self.num_processes)))
+        if stage['bytes_written'] > 0:
+            details.append("{} bytes written".format(stage['bytes_written']))
+        logging.info("Stage '{}' took {:.3f} seconds{}".format(stage['name'], stage['wall_time'], " ({})".format(", ".join(details)) if len(details) > 0 else ""))
+
+    # records the time a helper process spent on a task of the current stage
+    def add_worker_time(self, busy_time):
+        if self.current is not None:
+            self.current['worker_busy_time'] += busy_time
+
+    # records a file or directory written by the current stage
+    def add_output(self, path):
+        size = get_size(path)
+        self.outputs[path] = size
+        if self.current is not None:
+            self.current['bytes_written'] += size
+
+    def finish(self, filename):
+        wall_time = time.time() - self.start_time
+        report = {
+            'name': self.name,
+            'start_time': self.start_time,
+            'wall_time': wall_time,
+            'num_processes': self.num_processes,
+            'peak_rss': get_peak_rss(),
+            # the largest of the helper processes that have exited
+            'peak_worker_rss': get_peak_rss(resource.RUSAGE_CHILDREN),
+            'bytes_written': sum(self.outputs.values()),
+            'outputs': self.outputs,
+            'stages': [],
+        }
+        for stage in self.stages:
+            stage = dict(stage)
+            if stage['count'] is not None and stage['wall_time'] > 0:
+                stage['rate'] = stage['count']/stage['wall_time']
+            stage['worker_utilization'] = get_utilization(stage, self.num_processes)
+            report['stages'].append(stage)
+
+        logging.info("Run took {:.3f} seconds with peak RSS of {} bytes ({} bytes in helper processes) and wrote {} bytes".format(
+            wall_time, report['peak_rss'], report['peak_worker_rss'], report['bytes_written']))
+        logging.info("Saving timing report to '{}'".format(filename))
+        with open(filename, 'w') as outf:
+            json.dump(report, outf, indent=2)
+
+# the fraction of the available helper process time spent working on tasks
+def get_utilization(stage, num_processes):
+    if stage['wall_time'] <= 0:
+        return 0.0
+    return stage['worker_busy_time']/(stage['wall_time'] * num_processes)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+# Per-relay metrics computed over the timelines of a relay in the columnar
+# archive (see TorArchive.cons_view and TorArchive.sdesc_view), or over the
+# timelines of a block of relays at once.
+
+import numpy
+
+from numpy import mean, std
+
+from torbwest.archive import FLAG_EXIT, FLAG_GUARD, FLAG_UNMEASURED
+
+# percent of the relay's consensuses in which it held each position
+def position_fractions(ct):
+    num_cons = len(ct['flags'])
+    if num_cons == 0:
+        return None
+
+    # each consensus, you are either an exit, guard, or middle
+    is_exit = (ct['flags'] & FLAG_EXIT) != 0
+    is_guard = ~is_exit & ((ct['flags'] & FLAG_GUARD) != 0)
+    num_exit = int(is_exit.sum())
+    num_guard = int(is_guard.sum())
+    num_middle = num_cons - num_exit - num_guard
+
+    return {
+        'exit': 100.0*num_exit/num_cons,
+        'guard': 100.0*num_guard/num_cons,
+        'middle': 100.0*num_middle/num_cons,
+    }
+
+# the position in which each relay spent most of its time, given the exit,
+# guard, and middle position_fractions of the relays, or 'na' for relays with
+# nan fractions (e.g., see torbwest.store.load_relay_columns)
+def get_relay_positions(exit, guard, middle):
+    positions = numpy.full(len(exit), 'middle', dtype='U6')
+    positions[(guard > exit) & (guard > middle)] = 'guard'
+    positions[(exit > guard) & (exit > middle)] = 'exit'
+    positions[numpy.isnan(exit)] = 'na'
+    return positions
+
+# percent of all consensuses in which the relay appeared
+def uptime(ct, num_cons):
+    return 100.0*len(ct['ts'])/num_cons
+
+# mean normalized consensus weight, in percent
+def mean_weight(ct):
+    if len(ct['weight']) == 0:
+        return None
+    return 100.0*mean(ct['weight'])
+
+def mean_advbw(st):
+    if len(st['adv_bw']) == 0:
+        return None
+    return mean(st['adv_bw'])
+
+# returns the mean over the per-bin rel. std. dev. of the advertised bws of each
+# of the num_relays relays in the cons and sdesc blocks ct and st (see
+# TorArchive.cons_block and TorArchive.sdesc_block), or nan for relays that have
+# no rsd; only descriptors published in [start, end) are considered, and they
+# are binned into periods of bin_days days counted from start
+def mean_rsds(ct, st, num_relays, start, end, bin_days=7):
+    '''
+    for relays that were measured for at least a consensus, we compute the mean over the
+    per week rel. std. dev. of their advertised bws over only those weeks where their
+    bwrate or bwburst limits did not reduce the advertised bw
+    '''
+    num_days = int((end - start) // DAY) + 1
+
+    # ignore days where the relay was in an unmeasured status
+    c_ts = ct['ts']
+    is_measured = (c_ts >= start) & (c_ts < end) & ((ct['flags'] & FLAG_UNMEASURED) == 0)
+    c_relay, c_ts = ct['relay'][is_measured], c_ts[is_measured]
+    day_key = c_relay * num_days + get_day_nums(c_ts, start)
+
+    # the time of the first measured consensus of each relay on each day, rows
+    # are sorted by relay and time so it is the first row with each day key
+    is_first = first_of_runs(day_key)
+    first_measured = numpy.full(num_relays * num_days, -numpy.inf)
+    first_measured[day_key[is_first]] = c_ts[is_first]
+
+    # only consider server descriptors inside the window
+    s_ts = st['ts']
+    in_window = (s_ts >= start) & (s_ts < end)
+    s_relay, s_ts = st['relay'][in_window], s_ts[in_window]
+    adv_bw, obs_bw = st['adv_bw'][in_window], st['obs_bw'][in_window]
+    bw_lim = numpy.minimum(st['avg_bw'][in_window], st['brst_bw'][in_window])
+
+    day_nums = get_day_nums(s_ts, start)
+    bin_key = s_relay * (num_days // bin_days + 1) + day_nums // bin_days
+    bin_starts, bin_ids = get_runs(bin_key)
+
+    # ignore bins where the bw rate or burst reduced the advertised bw: the
+    # bwlim may change during the bin, but this will only affect our rsd
+    # variation calculation if the bwlim was low enough to cause us to report a
+    # different advertised bw than we normally would. This is only the case if
+    # the observed and advertised bw are not the same.
+    changed = (bw_lim != bw_lim[bin_starts][bin_ids]) & (adv_bw != obs_bw)
+    is_limited = numpy.bincount(bin_ids, weights=changed, minlength=len(bin_starts)) > 0
+
+    # we were not marked as measured until AFTER a descriptor, so skip it
+    # we do this by day in case some relays go in and out of measured state over time
+    is_early = first_measured[s_relay * num_days + day_nums] > s_ts
+
+    keep = ~is_limited[bin_ids] & ~is_early
+    adv_bw, bin_key, s_relay = adv_bw[keep], bin_key[keep], s_relay[keep]
+
+    # compute the rel. std. dev. for each bin
+    bin_starts, bin_ids = get_runs(bin_key)
+    bin_counts = numpy.diff(numpy.append(bin_starts, len(bin_key)))
+    s = reduce_groups(std, adv_bw, bin_starts, bin_counts)
+    m = reduce_groups(mean, adv_bw, bin_starts, bin_counts)
+    has_rsd = m > 0
+    rsds, rsd_relays = s[has_rsd] / m[has_rsd], s_relay[bin_starts][has_rsd]
+
+    # and the mean over each relay's bins
+    relay_starts, relay_ids = get_runs(rsd_relays)
+    relay_counts = numpy.diff(numpy.append(relay_starts, len(rsd_relays)))
+    relay_rsds = numpy.full(num_relays, numpy.nan)
+    relay_rsds[rsd_relays[relay_starts]] = reduce_groups(mean, rsds, relay_starts, relay_counts)
+
+    # ignore relays that have not been in a measured state in at least one consensus
+    relay_rsds[numpy.bincount(c_relay, minlength=num_relays) == 0] = numpy.nan
+
+    return relay_rsds
+
+# compares the relays in the cons and sdesc blocks ct and st before and after
+# an event at start: returns their mean weight in the consensuses and max adv
+# bw in the server descriptors published in (min_ts, start] and in
+# (start, stop], as arrays with one entry per relay that are 0 for relays
+# without any such documents
+def window_diffs(ct, st, num_relays, min_ts, start, stop):
+    diffs = {}
+    for (name, lo, hi) in [('before', min_ts, start), ('after', start, stop)]:
+        in_window = (ct['ts'] > lo) & (ct['ts'] <= hi)
+        diffs['weight_' + name] = reduce_relays(mean, ct['relay'][in_window], ct['weight'][in_window], num_relays)
+        in_window = (st['ts'] > lo) & (st['ts'] <= hi)
+        diffs['advbw_' + name] = reduce_relays(numpy.max, st['relay'][in_window], st['adv_bw'][in_window], num_relays, dtype='int64')
+    return diffs
+
+# applies func to the values of each relay, given the sorted relay index of
+# each value; relays without values get 0
+def reduce_relays(func, relays, values, num_relays, dtype='float64'):
+    starts, ids = get_runs(relays)
+    counts = numpy.diff(numpy.append(starts, len(relays)))
+    results = numpy.zeros(num_relays, dtype=dtype)
+    results[relays[starts]] = reduce_groups(func, values, starts, counts, dtype=dtype)
+    return results
+
+DAY = 24*3600
+
+def get_day_nums(ts, start):
+    return ((ts - start) // DAY).astype('int64')
+
+# true for each element that differs from its predecessor in a sorted array
+def first_of_runs(keys):
+    is_first = numpy.ones(len(keys), dtype=bool)
+    is_first[1:] = keys[1:] != keys[:-1]
+    return is_first
+
+# returns the start index of each run of equal keys in a sorted array, and
+# the run number of each element
+def get_runs(keys):
+    is_first = first_of_runs(keys)
+    return numpy.flatnonzero(is_first), numpy.cumsum(is_first) - 1
+
+# applies func (e.g., numpy.std) to each group values[starts[k]:starts[k]+counts[k]];
+# groups of equal size are reduced together as the rows of a 2d array, which
+# sums each group in the same order as calling func on the group by itself
+def reduce_groups(func, values, starts, counts, dtype='float64'):
+    results = numpy.zeros(len(starts), dtype=dtype)
+    for count in numpy.unique(counts):
+        groups = numpy.flatnonzero(counts == count)
+        rows = values[starts[groups, None] + numpy.arange(count)]
+        results[groups] = func(rows, axis=1)
+    return results
+
+# as-of join of a block's consensus and server descriptor timelines: returns,
+# for each row of ct, the index of the row of st holding the latest server
+# descriptor of the same relay published at or before the consensus, or -1
+# if there is none
+def latest_sdesc_rows(ct, st):
+    num_sdesc = len(st['ts'])
+
+    # merge both timelines by relay and time, with descriptors ahead of
+    # consensuses with the same timestamp
+    relays = numpy.concatenate((st['relay'], ct['relay']))
+    ts = numpy.concatenate((st['ts'], ct['ts']))
+    is_cons = numpy.arange(len(ts)) >= num_sdesc
+    order = numpy.lexsort((is_cons, ts, relays))
+
+    # the most recent descriptor row at each point of the merged timeline;
+    # descriptor rows are sorted by relay and time, so this is a running max
+    latest = numpy.maximum.accumulate(numpy.where(is_cons[order], -1, order))
+
+    cons_pos = numpy.flatnonzero(is_cons[order])
+    cons_rows, found = order[cons_pos] - num_sdesc, latest[cons_pos]
+
+    # the latest descriptor may belong to a previous relay
+    is_valid = found >= 0
+    is_valid[is_valid] = st['relay'][found[is_valid]] == ct['relay'][cons_rows[is_valid]]
+
+    rows = numpy.full(len(ct['ts']), -1, dtype='int64')
+    rows[cons_rows] = numpy.where(is_valid, found, -1)
+    return rows
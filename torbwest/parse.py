@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+
+# Parses archived collector consensuses and server descriptors into a columnar
+# archive; each pipeline's parse_tor_archive.py calls main with its own window.
+
+import io
+import random
+import logging
+
+from functools import partial
+from multiprocessing import Pool, cpu_count
+from argparse import ArgumentParser
+
+import numpy
+
+from stem.descriptor import parse_file
+
+from torbwest.archive import build_columns, encode_flags, save_columns
+from torbwest.shards import ShardedArchiveWriter
+from torbwest.collector import get_input_paths, iter_tarball
+from torbwest.scanner import scan_consensus, scan_server_descriptors
+from torbwest.cache import ParseCache
+from torbwest.instrument import start_report
+from torbwest.util import parallelize, stream, setup_logging, CustomHelpFormatter
+
+# only documents published in [min_ts, max_ts) are included in the archive
+def main(min_ts, max_ts):
+    args = get_args()
+    setup_logging('collector-parser', args.logfile)
+    report = start_report('collector-parser')
+    window = (min_ts, max_ts)
+
+    cons_paths = get_input_paths(args.consensuses)
+    sdesc_paths = get_input_paths(args.server_descriptors)
+
+    worker_pool = Pool(cpu_count(), initializer=init_worker, initargs=(args.fast, args.cross_check))
+    cache = ParseCache(args.cache) if args.cache is not None else None
+
+    if args.stream:
+        run_streaming(args, report, worker_pool, cache, window, cons_paths, sdesc_paths)
+    else:
+        run_in_memory(args, report, worker_pool, cache, window, cons_paths, sdesc_paths)
+
+    if cache is not None:
+        cache.close()
+
+    # let the helpers exit so that their peak memory usage is reported
+    worker_pool.close()
+    worker_pool.join()
+    report.finish(args.timing_report)
+
+    logging.info("All done!")
+
+def run_in_memory(args, report, worker_pool, cache, window, cons_paths, sdesc_paths):
+    with report.stage('parse consensuses', unit='documents') as stage:
+        logging.info("Processing {} consensus files and {} tarballs...".format(len(cons_paths[0]), len(cons_paths[1])))
+        cons_results = list(iter_cons_results(worker_pool, cache, window, cons_paths, False))
+        logging.info("Got {} consensus results".format(len(cons_results)))
+        stage['count'] = len(cons_results)
+
+    with report.stage('parse server descriptors', unit='documents') as stage:
+        logging.info("Processing {} server descriptor files and {} tarballs...".format(len(sdesc_paths[0]), len(sdesc_paths[1])))
+        sdesc_results = list(iter_sdesc_results(worker_pool, cache, window, sdesc_paths, False))
+        logging.info("Got {} server descriptor results".format(len(sdesc_results)))
+        stage['count'] = len(sdesc_results)
+
+    with report.stage('merge', unit='relays') as stage:
+        logging.info("Merging all results...")
+        columns = merge_results(cons_results, sdesc_results)
+        logging.info("Got {} relays".format(len(columns['fingerprints'])))
+        stage['count'] = len(columns['fingerprints'])
+
+    with report.stage('save archive'):
+        logging.info("Saving parsed data to disk as columnar archive '{}'".format(args.output))
+        save_columns(args.output, columns)
+        report.add_output(args.output)
+
+# fold results into on-disk shards as they arrive rather than holding them all
+def run_streaming(args, report, worker_pool, cache, window, cons_paths, sdesc_paths):
+    shard_dir = args.output + '.shards'
+    writer = ShardedArchiveWriter(shard_dir)
+
+    with report.stage('parse consensuses', unit='documents') as stage:
+        logging.info("Streaming {} consensus files and {} tarballs into shards in '{}'...".format(len(cons_paths[0]), len(cons_paths[1]), shard_dir))
+        for result in iter_cons_results(worker_pool, cache, window, cons_paths, True):
+            writer.add_cons_result(result)
+        logging.info("Got {} consensus results".format(len(writer.cons_times)))
+        stage['count'] = len(writer.cons_times)
+
+    with report.stage('parse server descriptors', unit='documents') as stage:
+        logging.info("Streaming {} server descriptor files and {} tarballs into shards...".format(len(sdesc_paths[0]), len(sdesc_paths[1])))
+        stage['count'] = 0
+        for result in iter_sdesc_results(worker_pool, cache, window, sdesc_paths, True):
+            writer.add_sdesc_result(result)
+            stage['count'] += 1
+
+    with report.stage('assemble archive', unit='relays') as stage:
+        logging.info("Saving parsed data to disk as columnar archive '{}'".format(args.output))
+        num_relays = writer.finish(args.output)
+        logging.info("Got {} relays".format(num_relays))
+        stage['count'] = num_relays
+        report.add_output(args.output)
+
+def iter_cons_results(worker_pool, cache, window, cons_paths, streaming):
+    for result in iter_parsed(worker_pool, cache, process_cons_file, 'cons', cons_paths[0], streaming):
+        if in_window(result, window): yield result
+    for tarball_results in iter_parsed(worker_pool, cache, process_cons_tarball, 'cons-tarball', cons_paths[1], streaming, chunksize=1):
+        for result in tarball_results:
+            if in_window(result, window): yield result
+
+def iter_sdesc_results(worker_pool, cache, window, sdesc_paths, streaming):
+    for file_results in iter_parsed(worker_pool, cache, process_sdesc_file, 'sdesc', sdesc_paths[0], streaming):
+        for result in file_results:
+            if in_window(result, window): yield result
+    for tarball_results in iter_parsed(worker_pool, cache, process_sdesc_tarball, 'sdesc-tarball', sdesc_paths[1], streaming, chunksize=1):
+        for result in tarball_results:
+            if in_window(result, window): yield result
+
+# the window is applied here rather than in the workers so that cached results
+# stay valid when the window is changed
+def in_window(result, window):
+    return result is not None and result['pub_ts'] >= window[0] and result['pub_ts'] < window[1]
+
+# yields the result of func for each path, taking the results of files that have
+# not changed since they were last parsed from the cache
+def iter_parsed(worker_pool, cache, func, kind, paths, streaming, chunksize=100):
+    misses = paths
+    if cache is not None and len(paths) > 0:
+        misses = []
+        for path in paths:
+            hit, result = cache.get(kind, path)
+            if hit:
+                yield result
+            else:
+                misses.append(path)
+        logging.info("Found {}/{} {} results in the parse cache".format(len(paths)-len(misses), len(paths), kind))
+
+    keyed_func = partial(call_with_path, func)
+    if streaming:
+        keyed_results = stream(worker_pool, keyed_func, misses, chunksize=chunksize)
+    else:
+        keyed_results = parallelize(worker_pool, keyed_func, misses)
+
+    for (path, result) in keyed_results:
+        if cache is not None:
+            cache.put(kind, path, result)
+        yield result
+
+# this func is run by helper processes in process pool
+def call_with_path(func, path):
+    return path, func(path)
+
+# these are set in each helper process in the process pool by init_worker
+FAST_SCAN = False
+CROSS_CHECK_RATE = 0.0
+
+def init_worker(fast_scan, cross_check_rate):
+    global FAST_SCAN, CROSS_CHECK_RATE
+    FAST_SCAN = fast_scan
+    CROSS_CHECK_RATE = cross_check_rate
+
+# this func is run by helper processes in process pool
+def process_cons_file(path):
+    with open(path, 'rb') as inf:
+        return process_cons_data(inf.read())
+
+# this func is run by helper processes in process pool, one tarball per process
+def process_cons_tarball(path):
+    results = []
+    for (name, data) in iter_tarball(path):
+        results.append(process_cons_data(data))
+    return results
+
+def process_cons_data(data):
+    if not FAST_SCAN:
+        net_status = next(parse_file(io.BytesIO(data), document_handler='DOCUMENT', validate=False))
+        return process_cons_document(net_status)
+
+    result = process_cons_document(scan_consensus(data))
+
+    # compare a sample of the fast scanner results against a full stem parse
+    if CROSS_CHECK_RATE > 0 and random.random() < CROSS_CHECK_RATE:
+        net_status = next(parse_file(io.BytesIO(data), document_handler='DOCUMENT', validate=False))
+        expected = process_cons_document(net_status)
+        if result != expected:
+            logging.warning("Fast scanner result differs from stem for consensus valid after {}, using stem result".format(net_status.valid_after))
+            return expected
+
+    return result
+
+def process_cons_document(net_status):
+    assert net_status.valid_after != None
+    pub_ts = float(net_status.valid_after.strftime("%s"))
+
+    cons_bw_sum = 0
+    relays = {}
+
+    for (fp, router_entry) in net_status.routers.items():
+        if router_entry.bandwidth != None:
+            bw = int(router_entry.bandwidth)
+            is_unmeasured = router_entry.is_unmeasured
+            relays.setdefault(fp, {'bw': bw, 'isunmeasured': is_unmeasured, \
+                "isexit": True if "Exit" in router_entry.flags else False, \
+                "isguard": True if "Guard" in router_entry.flags else False})
+            cons_bw_sum += bw
+
+    result = {
+        'pub_ts': pub_ts,
+        'relays': {},
+    }
+
+    for (fp, d) in relays.items():
+        result['relays'][fp] = {
+            "weight": float(d['bw'])/float(cons_bw_sum),
+            "isunmeasured": d['isunmeasured'],
+            "isexit": d['isexit'],
+            "isguard": d['isguard'],
+        }
+
+    return result
+
+# this func is run by helper processes in process pool
+def process_sdesc_file(path):
+    with open(path, 'rb') as inf:
+        return process_sdesc_data(inf.read())
+
+# this func is run by helper processes in process pool, one tarball per process
+def process_sdesc_tarball(path):
+    results = []
+    for (name, data) in iter_tarball(path):
+        results.extend(process_sdesc_data(data))
+    return results
+
+# returns a result for each of the (possibly concatenated) descriptors in data
+def process_sdesc_data(data):
+    if FAST_SCAN:
+        try:
+            relays = scan_server_descriptors(data)
+        except ValueError as e:
+            # malformed descriptors are left for stem to deal with
+            logging.warning("Fast scanner could not handle server descriptor, falling back to stem: {}".format(e))
+            relays = None
+    else:
+        relays = None
+
+    if relays is None:
+        relays = parse_file(io.BytesIO(data), document_handler='DOCUMENT', descriptor_type='server-descriptor 1.0', validate=False)
+        return [process_sdesc_document(relay) for relay in relays]
+
+    results = [process_sdesc_document(relay) for relay in relays]
+
+    # compare a sample of the fast scanner results against a full stem parse
+    if CROSS_CHECK_RATE > 0 and random.random() < CROSS_CHECK_RATE:
+        relays = parse_file(io.BytesIO(data), document_handler='DOCUMENT', descriptor_type='server-descriptor 1.0', validate=False)
+        expected = [process_sdesc_document(relay) for relay in relays]
+        if results != expected:
+            logging.warning("Fast scanner results differ from stem for {} server descriptor(s), using stem results".format(len(expected)))
+            return expected
+
+    return results
+
+def process_sdesc_document(relay):
+    if relay.observed_bandwidth == None:
+        return None
+
+    assert relay.published != None
+    pub_ts = float(relay.published.strftime("%s"))
+
+    obs_bw = int(relay.observed_bandwidth)
+    avg_bw, brst_bw = 0, 0
+
+    advertised_bw = obs_bw
+
+    if relay.average_bandwidth != None:
+        avg_bw = int(relay.average_bandwidth)
+        advertised_bw = min(advertised_bw, avg_bw)
+
+    if relay.burst_bandwidth != None:
+        brst_bw = int(relay.burst_bandwidth)
+        advertised_bw = min(advertised_bw, brst_bw)
+
+    #'nickname': relay.nickname,
+    result = {
+        'fprint': relay.fingerprint,
+        'pub_ts': pub_ts,
+        'adv_bw': advertised_bw,
+        'obs_bw': obs_bw,
+        'avg_bw': avg_bw,
+        'brst_bw': brst_bw,
+    }
+
+    return result
+
+def merge_results(cons_results, sdesc_results):
+    fp_ids = {}
+    cons_times = []
+    cons_rows = {'fp': [], 'ts': [], 'weight': [], 'flags': []}
+
+    for result in cons_results:
+        if result is None: continue
+
+        ts = float(result['pub_ts'])
+        cons_times.append(ts)
+
+        for (fp, d) in result['relays'].items():
+            cons_rows['fp'].append(fp_ids.setdefault(fp, len(fp_ids)))
+            cons_rows['ts'].append(ts)
+            cons_rows['weight'].append(d['weight'])
+            cons_rows['flags'].append(encode_flags(d['isunmeasured'], d['isexit'], d['isguard']))
+
+    sdesc_results = [result for result in sdesc_results if result is not None]
+    sdesc_ts = numpy.array([float(result['pub_ts']) for result in sdesc_results], dtype='float64')
+
+    # only inlude server descriptors within the consensus period
+    if len(cons_times) > 0:
+        in_window = (sdesc_ts >= min(cons_times)) & (sdesc_ts <= max(cons_times))
+    else:
+        in_window = numpy.zeros(len(sdesc_ts), dtype=bool)
+
+    sdesc_rows = {'fp': [], 'ts': sdesc_ts[in_window], 'adv_bw': [], 'obs_bw': [], 'avg_bw': [], 'brst_bw': []}
+
+    for i in numpy.flatnonzero(in_window):
+        result = sdesc_results[i]
+        sdesc_rows['fp'].append(fp_ids.setdefault(result['fprint'], len(fp_ids)))
+        for name in ['adv_bw', 'obs_bw', 'avg_bw', 'brst_bw']:
+            sdesc_rows[name].append(int(result[name]))
+
+    # group the rows by relay into sorted per-relay timelines
+    return build_columns(fp_ids, cons_times, cons_rows, sdesc_rows)
+
+def get_args():
+    parser = ArgumentParser(
+            description='Parse a set of archived collector consensus and server descriptors',
+            formatter_class=CustomHelpFormatter)
+
+    parser.add_argument('consensuses', help="Path to a consensus tarball or to a directory containing multiple consensus files and/or tarballs", metavar="PATH")
+    parser.add_argument('server_descriptors', help="Path to a server descriptor tarball or to a directory containing multiple server descriptor files and/or tarballs", metavar="PATH")
+    parser.add_argument('-o', '--output', help="Path to the directory in which to store the parsed columnar archive", metavar="PATH", default="tor.archive")
+    parser.add_argument('-s', '--stream', help="Fold results into per-month shards on disk as they arrive to bound memory usage", action="store_true", default=False)
+    parser.add_argument('-f', '--fast', help="Scan consensus and server descriptor documents with lightweight line scanners instead of parsing them with stem", action="store_true", default=False)
+    parser.add_argument('-c', '--cross-check', help="With --fast, the fraction of documents to also parse with stem to verify the scanner output", metavar="FRACTION", type=float, default=0.0)
+    parser.add_argument('--cache', help="Path to a sqlite database in which to cache per-file parse results across runs", metavar="PATH", default=None)
+    parser.add_argument('-l', '--logfile', help="Name of the file to store log output in addition to stdout", metavar="PATH", default="parser.log")
+    parser.add_argument('-t', '--timing-report', help="Name of the file to store a json report of the time, throughput, and memory usage of each stage in", metavar="PATH", default="parser.timing.json")
+
+    args = parser.parse_args()
+    return args
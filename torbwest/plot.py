@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# Plotting helpers shared by the plot scripts of both pipelines.
+
+import matplotlib
+
+from numpy import arange, isnan, mean, median, std
+from scipy.stats import scoreatpercentile as score
+
+# overrides replaces or extends the default matplotlib options below
+def set_plot_options(overrides=None):
+    options = {
+        #'backend': 'PDF',
+        'font.size': 12,
+        'figure.figsize': (3,2.0),
+        'figure.dpi': 100.0,
+        'figure.subplot.left': 0.20,
+        'figure.subplot.right': 0.97,
+        'figure.subplot.bottom': 0.20,
+        'figure.subplot.top': 0.90,
+        'grid.color': '0.1',
+        'grid.linestyle': ':',
+        #'grid.linewidth': 0.5,
+        'axes.grid' : True,
+        #'axes.grid.axis' : 'y',
+        #'axes.axisbelow': True,
+        'axes.titlesize' : 'x-small',
+        'axes.labelsize' : 8,
+        'axes.formatter.limits': (-4,4),
+        'xtick.labelsize' : 7,
+        'ytick.labelsize' : 7,
+        'lines.linewidth' : 2.0,
+        'lines.markeredgewidth' : 0.5,
+        'lines.markersize' : 2,
+        'legend.fontsize' : 7,
+        'legend.fancybox' : False,
+        'legend.shadow' : False,
+        'legend.borderaxespad' : 0.5,
+        'legend.numpoints' : 1,
+        'legend.handletextpad' : 0.5,
+        'legend.handlelength' : 2.0,
+        'legend.labelspacing' : .75,
+        'legend.markerscale' : 1.0,
+        # turn on the following to embedd fonts; requires latex
+        'ps.useafm' : True,
+        'pdf.use14corefonts' : True,
+        'text.usetex' : True,
+    }
+
+    if overrides is not None:
+        options.update(overrides)
+
+    for option_key in options:
+        matplotlib.rcParams[option_key] = options[option_key]
+
+    if 'figure.max_num_figures' in matplotlib.rcParams:
+        matplotlib.rcParams['figure.max_num_figures'] = 50
+    if 'figure.max_open_warning' in matplotlib.rcParams:
+        matplotlib.rcParams['figure.max_open_warning'] = 50
+    if 'legend.ncol' in matplotlib.rcParams:
+        matplotlib.rcParams['legend.ncol'] = 50
+
+## helper - cumulative fraction for y axis
+def cf(d): return arange(1.0,float(len(d))+1.0)/float(len(d))
+
+## helper - return step-based CDF x and y values
+## only show to the 99th percentile by default
+def getcdf(data, shownpercentile=1.0, maxpoints=100000.0):
+    data.sort()
+    frac = cf(data)
+    k = len(data)/maxpoints
+    x, y, lasty = [], [], 0.0
+    for i in range(int(round(len(data)*shownpercentile))):
+        if i % k > 1.0: continue
+        assert not isnan(data[i])
+        x.append(data[i])
+        y.append(lasty)
+        x.append(data[i])
+        y.append(frac[i])
+        lasty = frac[i]
+    return x, y
+
+def print_stats(msg, dist, compact=False):
+    b = sorted(dist)#.values()
+    print(msg)
+    if compact:
+        print("min={} q1={} median={} q3={} max={} mean={} stddev={}".format(min(b), score(b, 25), median(b), score(b, 75), max(b), mean(b), std(b)))
+    else:
+        print("\tlength={}\n\tmin={}\n\t10={}\n\tq1={}\n\tmedian={}\n\tq3={}\n\t90={}\n\tmax={}\n\tmean={}\n\tstddev={}".format(len(b), min(b), score(b, 10), score(b, 25), median(b), score(b, 75), score(b, 90), max(b), mean(b), std(b)))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+# Lightweight scanners for collector documents that only look at the handful
+# of lines we use, rather than building stem's full document model.
+#
+# The scanned objects expose the same attributes that the parse scripts read
+# from stem's documents, so they can be passed to the same processing code.
+
+import binascii
+
+from collections import namedtuple
+from datetime import datetime
+
+ScannedConsensus = namedtuple('ScannedConsensus', ['valid_after', 'routers'])
+ScannedRouterEntry = namedtuple('ScannedRouterEntry', ['bandwidth', 'is_unmeasured', 'flags'])
+
+def identity_to_fingerprint(identity):
+    # 'r' lines hold the identity as unpadded base64
+    padding = b'=' * (-len(identity) % 4)
+    return binascii.a2b_base64(identity + padding).hex().upper()
+
+# scans the valid-after, r, s, and w lines of a network status consensus
+def scan_consensus(data):
+    valid_after = None
+    routers = {}
+    fp, bandwidth, is_unmeasured, flags = None, None, False, []
+
+    for line in data.splitlines():
+        # dispatch on the keyword of the router status entry lines
+        key = line[:2]
+        if key == b'r ':
+            if fp is not None:
+                routers[fp] = ScannedRouterEntry(bandwidth, is_unmeasured, flags)
+            fp = identity_to_fingerprint(line.split(None, 3)[2])
+            bandwidth, is_unmeasured, flags = None, False, []
+        elif fp is None:
+            if line.startswith(b'valid-after '):
+                valid_after = datetime.strptime(line[12:].decode('ascii').strip(), "%Y-%m-%d %H:%M:%S")
+        elif key == b's ' or line == b's':
+            flags = line.decode('ascii').split()[1:]
+        elif key == b'w ':
+            for entry in line.split()[1:]:
+                if entry.startswith(b'Bandwidth='):
+                    bandwidth = int(entry[10:])
+                elif entry == b'Unmeasured=1':
+                    is_unmeasured = True
+        elif line.startswith(b'directory-footer'):
+            break
+
+    if fp is not None:
+        routers[fp] = ScannedRouterEntry(bandwidth, is_unmeasured, flags)
+
+    return ScannedConsensus(valid_after, routers)
+
+ScannedServerDescriptor = namedtuple('ScannedServerDescriptor', ['fingerprint', 'published', 'average_bandwidth', 'burst_bandwidth', 'observed_bandwidth'])
+
+# scans the router, published, fingerprint, and bandwidth lines of one or more
+# concatenated server descriptors; raises ValueError if any of them is
+# malformed so that the caller can fall back to parsing with stem
+def scan_server_descriptors(data):
+    descriptors = []
+    fields = None
+
+    for line in data.splitlines():
+        if line.startswith(b'opt '):
+            line = line[4:]
+
+        if line.startswith(b'router '):
+            if fields is not None:
+                descriptors.append(make_server_descriptor(fields))
+            fields = {}
+        elif fields is None:
+            continue
+        elif line.startswith(b'published '):
+            fields['published'] = datetime.strptime(line[10:].decode('ascii').strip(), "%Y-%m-%d %H:%M:%S")
+        elif line.startswith(b'fingerprint '):
+            fields['fingerprint'] = line[12:].decode('ascii').replace(' ', '').strip()
+        elif line.startswith(b'bandwidth '):
+            values = line.split()[1:]
+            if len(values) != 3 or not all(v.isdigit() for v in values):
+                raise ValueError("malformed bandwidth line: {}".format(line))
+            fields['bandwidth'] = [int(v) for v in values]
+
+    if fields is not None:
+        descriptors.append(make_server_descriptor(fields))
+
+    return descriptors
+
+def make_server_descriptor(fields):
+    if 'fingerprint' not in fields or len(fields['fingerprint']) != 40:
+        raise ValueError("server descriptor is missing a valid fingerprint")
+    if 'published' not in fields:
+        raise ValueError("server descriptor is missing its published time")
+
+    avg_bw, brst_bw, obs_bw = fields.get('bandwidth', [None, None, None])
+    return ScannedServerDescriptor(fields['fingerprint'], fields['published'], avg_bw, brst_bw, obs_bw)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+# Streaming construction of a columnar archive (see archive.py).
+#
+# Parse results are folded into per-month row buffers as soon as the worker
+# pool returns them, and each buffer is flushed to an uncompressed .npz shard
+# once it grows past a row limit. The final archive is then assembled from the
+# shards one column at a time, so peak memory is bounded by the size of a
+# single column rather than by the nested dicts of all parse results.
+
+import os
+import glob
+import shutil
+import logging
+
+from datetime import datetime, timezone
+
+import numpy
+
+from torbwest.archive import COLUMNS, CONS_FIELDS, SDESC_FIELDS, encode_flags, group_rows, save_column, save_meta, sort_fingerprints
+
+CONS_SHARD_COLUMNS = {'fp': 'int32', 'ts': 'float64', 'weight': 'float64', 'flags': 'uint8'}
+SDESC_SHARD_COLUMNS = {'fp': 'int32', 'ts': 'float64', 'adv_bw': 'int64', 'obs_bw': 'int64', 'avg_bw': 'int64', 'brst_bw': 'int64'}
+
+class ShardedArchiveWriter(object):
+    def __init__(self, shard_dir, flush_rows=250000):
+        self.shard_dir = os.path.abspath(os.path.expanduser(shard_dir))
+        self.flush_rows = flush_rows
+        self.fp_ids = {}
+        self.cons_times = []
+        self.buffers = {'cons': {}, 'sdesc': {}}
+        self.num_shards = 0
+
+        if os.path.exists(self.shard_dir):
+            shutil.rmtree(self.shard_dir)
+        os.makedirs(self.shard_dir)
+
+    def intern(self, fp):
+        return self.fp_ids.setdefault(fp, len(self.fp_ids))
+
+    def add_cons_result(self, result):
+        if result is None: return
+
+        ts = float(result['pub_ts'])
+        self.cons_times.append(ts)
+
+        month = get_month(ts)
+        buf = self.get_buffer('cons', month)
+        for (fp, d) in result['relays'].items():
+            buf['fp'].append(self.intern(fp))
+            buf['ts'].append(ts)
+            buf['weight'].append(d['weight'])
+            buf['flags'].append(encode_flags(d['isunmeasured'], d['isexit'], d['isguard']))
+
+        if len(buf['fp']) >= self.flush_rows:
+            self.flush_buffer('cons', month)
+
+    def add_sdesc_result(self, result):
+        if result is None: return
+
+        ts = float(result['pub_ts'])
+
+        month = get_month(ts)
+        buf = self.get_buffer('sdesc', month)
+        buf['fp'].append(self.intern(result['fprint']))
+        buf['ts'].append(ts)
+        for name in ['adv_bw', 'obs_bw', 'avg_bw', 'brst_bw']:
+            buf[name].append(int(result[name]))
+
+        if len(buf['fp']) >= self.flush_rows:
+            self.flush_buffer('sdesc', month)
+
+    def get_buffer(self, kind, month):
+        columns = CONS_SHARD_COLUMNS if kind == 'cons' else SDESC_SHARD_COLUMNS
+        return self.buffers[kind].setdefault(month, {name: [] for name in columns})
+
+    def flush_buffer(self, kind, month):
+        buf = self.buffers[kind].pop(month, None)
+        if buf is None or len(buf['fp']) == 0: return
+
+        columns = CONS_SHARD_COLUMNS if kind == 'cons' else SDESC_SHARD_COLUMNS
+        arrays = {name: numpy.array(buf[name], dtype=columns[name]) for name in columns}
+
+        # the global shard counter keeps track of the order in which results arrived
+        filename = "{}-{}-{:06d}.npz".format(kind, month, self.num_shards)
+        numpy.savez(os.path.join(self.shard_dir, filename), **arrays)
+        self.num_shards += 1
+
+    def flush(self):
+        for kind in self.buffers:
+            for month in list(self.buffers[kind].keys()):
+                self.flush_buffer(kind, month)
+
+    def finish(self, path, keep_shards=False):
+        self.flush()
+
+        # map the interned ids from arrival order onto the sorted fingerprint order
+        fps, remap = sort_fingerprints(self.fp_ids)
+        logging.info("Assembling archive for {} relays from {} shards".format(len(fps), self.num_shards))
+
+        cons_times = numpy.array(sorted(self.cons_times), dtype=COLUMNS['cons_times'])
+        save_column(path, 'fingerprints', fps)
+        save_column(path, 'cons_times', cons_times)
+
+        num_cons_entries = self.assemble(path, 'cons', remap, len(fps), None)
+
+        # only inlude server descriptors within the consensus period
+        window = (cons_times[0], cons_times[-1]) if len(cons_times) > 0 else (numpy.inf, -numpy.inf)
+        num_sdesc_entries = self.assemble(path, 'sdesc', remap, len(fps), window)
+
+        save_meta(path, len(fps), len(cons_times), num_cons_entries, num_sdesc_entries)
+
+        if not keep_shards:
+            shutil.rmtree(self.shard_dir)
+
+        return len(fps)
+
+    def assemble(self, path, kind, remap, num_relays, window):
+        columns = CONS_FIELDS if kind == 'cons' else SDESC_FIELDS
+        shard_paths = sorted(glob.glob(os.path.join(self.shard_dir, kind + '-*.npz')), key=get_shard_num)
+
+        fp = remap[self.load_column(shard_paths, 'fp', 'int32')]
+        ts = self.load_column(shard_paths, 'ts', 'float64')
+
+        if window is None:
+            rows = numpy.arange(len(ts))
+        else:
+            rows = numpy.flatnonzero((ts >= window[0]) & (ts <= window[1]))
+
+        offsets, order = group_rows(fp[rows], ts[rows], num_relays)
+        order = rows[order]
+        save_column(path, kind + '_offsets', offsets)
+
+        # load, permute and write one column at a time to bound memory
+        for (name, archive_name) in columns.items():
+            data = self.load_column(shard_paths, name, COLUMNS[archive_name])
+            save_column(path, archive_name, data[order])
+
+        return len(order)
+
+    def load_column(self, shard_paths, name, dtype):
+        parts = []
+        for shard_path in shard_paths:
+            with numpy.load(shard_path) as shard:
+                parts.append(shard[name])
+        if len(parts) == 0:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.concatenate(parts)
+
+def get_month(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m")
+
+def get_shard_num(shard_path):
+    return int(os.path.basename(shard_path).split('.')[0].split('-')[-1])
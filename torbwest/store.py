@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+# Output formats for the derived data the compute and process scripts store and
+# the plot scripts load, e.g., relay_rsds or speedtest.diffs. Each output is
+# stored as <name>.<format>:
+#
+#   json.xz  indented json compressed with xz, as read by the original scripts
+#   npz      a numpy .npz holding the keys of the output in a 'keys' array and
+#            each value (or each field of nested dict values, like
+#            'values.weight.before') in a column indexed like the keys; lists
+#            (like speedtest.measured) are stored in an 'items' array
+#
+# Per-relay outputs (see save_relay_data) are stored in npz files with the
+# fingerprint table of the archive they were computed from in a 'fingerprints'
+# array, and the relay ids (positions in that table) of the relays they hold
+# a value for in a 'relays' array instead of 'keys'. load_relay_data and
+# load_relay_columns return them in that form, so that outputs can be joined
+# by indexing arrays with relay ids rather than by looking up fingerprints.
+#
+# load_data picks whichever format of an output was written last, and returns
+# the same dicts and lists regardless of the format.
+
+import os
+import logging
+
+import numpy
+
+from torbwest.archive import COLUMNS, lookup_fingerprints
+from torbwest.instrument import get_report
+from torbwest.util import load_json, save_json
+
+FORMATS = ['json.xz', 'npz']
+DEFAULT_FORMAT = 'json.xz'
+
+def get_filename(name, fmt):
+    return '{}.{}'.format(name, fmt)
+
+def get_format(filename):
+    for fmt in FORMATS:
+        if filename.endswith('.' + fmt):
+            return fmt
+    return None
+
+# returns the most recently written file for the output name, which may also
+# be a filename with a format extension
+def find_filename(name):
+    if get_format(name) is not None:
+        return name
+    filenames = [get_filename(name, fmt) for fmt in FORMATS if os.path.exists(get_filename(name, fmt))]
+    if len(filenames) == 0:
+        raise FileNotFoundError("No {} file found for '{}'".format(' or '.join(FORMATS), name))
+    return max(filenames, key=os.path.getmtime)
+
+def save_data(data, name, fmt=DEFAULT_FORMAT):
+    filename = get_filename(name, fmt)
+    if fmt == 'json.xz':
+        save_json(data, filename)
+    else:
+        save_npz(get_columns(data), filename)
+    return filename
+
+# stores the values of the relays with the given ids in the fingerprints table,
+# e.g., of the archive the values were computed from
+def save_relay_data(fingerprints, relays, values, name, fmt=DEFAULT_FORMAT):
+    filename = get_filename(name, fmt)
+    if fmt == 'json.xz':
+        save_json(dict(zip(numpy.asarray(fingerprints)[relays].tolist(), values)), filename)
+    else:
+        columns = get_value_columns(values)
+        columns['fingerprints'] = numpy.asarray(fingerprints, dtype=COLUMNS['fingerprints'])
+        columns['relays'] = numpy.asarray(relays, dtype='int32')
+        save_npz(columns, filename)
+    return filename
+
+def save_npz(columns, filename):
+    logging.info("Saving data to disk as npz in '{}'".format(filename))
+    numpy.savez_compressed(filename, **columns)
+    if get_report() is not None:
+        get_report().add_output(filename)
+    logging.info("Done!")
+
+def load_data(name):
+    filename = find_filename(name)
+    if get_format(filename) != 'npz':
+        return load_json(filename)
+
+    columns = load_columns(filename)
+    if 'items' in columns:
+        return columns['items'].tolist()
+    if 'relays' in columns:
+        keys = columns.pop('fingerprints')[columns.pop('relays')].tolist()
+    else:
+        # json turns the float timestamp keys of time series into strings
+        keys = columns.pop('keys')
+        keys = [str(k) for k in keys.tolist()] if keys.dtype.kind == 'f' else keys.tolist()
+    return get_dict(keys, columns)
+
+# returns (fingerprints, relays, columns) for a per-relay output: the
+# fingerprint table, the relay id of each relay in the output in the order
+# they were stored, and the value columns (see get_value_columns) in the same
+# order. json.xz outputs get a table holding the sorted fingerprints they hold.
+def load_relay_data(name):
+    filename = find_filename(name)
+    if get_format(filename) == 'npz':
+        columns = load_columns(filename)
+        return columns.pop('fingerprints'), columns.pop('relays'), columns
+
+    data = load_json(filename)
+    fps = numpy.asarray(list(data.keys()), dtype=COLUMNS['fingerprints'])
+    fingerprints = numpy.sort(fps)
+    return fingerprints, lookup_fingerprints(fingerprints, fps), get_value_columns(list(data.values()))
+
+# returns the value columns of a per-relay output indexed by relay id in the
+# given fingerprint table, with nan for the relays that have no value in it
+def load_relay_columns(name, fingerprints):
+    output_fps, relays, columns = load_relay_data(name)
+    relays = lookup_fingerprints(fingerprints, output_fps[relays])
+    found = relays >= 0
+
+    dense = {}
+    for (path, values) in columns.items():
+        dense[path] = numpy.full(len(fingerprints), numpy.nan)
+        dense[path][relays[found]] = values[found]
+    return dense
+
+def load_columns(filename):
+    with numpy.load(os.path.abspath(os.path.expanduser(filename)), allow_pickle=False) as npz:
+        return {name: npz[name] for name in npz.files}
+
+# converts a dict of scalars, lists of scalars, or (nested) dicts of scalars
+# into columns indexed like its keys; every value must have the same structure
+def get_columns(data):
+    if isinstance(data, list):
+        return {'items': numpy.asarray(data)}
+    columns = get_value_columns(list(data.values()))
+    columns['keys'] = numpy.asarray(list(data.keys()))
+    return columns
+
+# converts a list of values into a 'values' column, or into a
+# 'values.<field>[.<field>...]' column for each field of dict values
+def get_value_columns(values):
+    columns = {}
+    if len(values) > 0:
+        for path in get_paths(values[0], 'values'):
+            columns['.'.join(path)] = numpy.asarray([get_field(v, path[1:]) for v in values])
+    return columns
+
+def get_paths(value, prefix):
+    if not isinstance(value, dict):
+        return [(prefix,)]
+    return [(prefix,) + path for field in value for path in get_paths(value[field], field)]
+
+def get_field(value, fields):
+    for field in fields:
+        value = value[field]
+    return value
+
+# the inverse of get_columns
+def get_dict(keys, columns):
+    if 'values' in columns:
+        return dict(zip(keys, columns['values'].tolist()))
+
+    data = {k: {} for k in keys}
+    for (path, values) in columns.items():
+        fields = path.split('.')[1:]
+        for (k, v) in zip(keys, values.tolist()):
+            d = data[k]
+            for field in fields[:-1]:
+                d = d.setdefault(field, {})
+            d[fields[-1]] = v
+    return data
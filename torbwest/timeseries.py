@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+# Network-wide advertised bandwidth per consensus, computed over blocks of relay
+# timelines (see TorArchive.cons_block and TorArchive.sdesc_block) and
+# optionally partitioned into groups of relays.
+
+import numpy
+
+from torbwest.archive import FLAG_EXIT, FLAG_GUARD
+from torbwest.metrics import latest_sdesc_rows
+
+# group names for get_position_groups, in group index order
+POSITIONS = ['exit', 'guard', 'middle']
+
+class AdvBwSeries(object):
+    def __init__(self, cons_times, group_names):
+        self.cons_times = numpy.unique(cons_times)
+        self.group_names = list(group_names)
+        # the adv bw summed over the relays in each group (rows) in each
+        # consensus (columns)
+        self.totals = numpy.zeros((len(self.group_names), len(self.cons_times)), dtype='int64')
+
+    # adds the adv bw of the relays in the cons and sdesc blocks ct and st in
+    # each consensus they appear in; groups holds the group index of each row
+    # of ct, or -1 for rows that should not be counted
+    def add_block(self, ct, st, groups):
+        # the adv bw of a relay in a consensus is that of the latest sdesc
+        # published at or before the consensus
+        sdesc_rows = latest_sdesc_rows(ct, st)
+        counted = (groups >= 0) & (sdesc_rows >= 0)
+
+        cons_idx = numpy.searchsorted(self.cons_times, ct['ts'][counted])
+        numpy.add.at(self.totals, (groups[counted], cons_idx), st['adv_bw'][sdesc_rows[counted]])
+
+    # adds the totals of another series over the same consensuses and groups,
+    # e.g., one computed by a helper process
+    def add_totals(self, totals):
+        self.totals += totals
+
+    # returns {ts: {'total': bw, group_name: bw, ...}}
+    def to_dict(self):
+        series = {}
+        for (ts, total, bws) in zip(self.cons_times.tolist(), self.totals.sum(axis=0).tolist(), self.totals.T.tolist()):
+            series[ts] = {'total': total}
+            series[ts].update(zip(self.group_names, bws))
+        return series
+
+# returns the group of each row of ct given the group index of each relay
+# in the block, e.g., from a relay set like the measured relays or an AS
+def get_relay_groups(relay_groups, ct):
+    return numpy.asarray(relay_groups)[ct['relay']]
+
+# returns the POSITIONS index of each row of ct: each consensus, a relay is
+# either an exit, guard, or middle
+def get_position_groups(ct):
+    groups = numpy.full(len(ct['flags']), POSITIONS.index('middle'), dtype='int64')
+    groups[(ct['flags'] & FLAG_GUARD) != 0] = POSITIONS.index('guard')
+    groups[(ct['flags'] & FLAG_EXIT) != 0] = POSITIONS.index('exit')
+    return groups
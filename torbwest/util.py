@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# Helpers shared by the parse, compute, and process scripts of both pipelines.
+
+import os
+import sys
+import json
+import lzma
+import logging
+
+from functools import partial
+from argparse import ArgumentDefaultsHelpFormatter
+
+from torbwest.instrument import get_report, timed_call
+
+def parallelize(worker_pool, func, work, batch_size=10000):
+    all_results = []
+    report = get_report()
+    work_batches = [work[i:i+batch_size] for i in range(0, len(work), batch_size)]
+
+    logging.info("Parallelizing {} work tasks in {} batch(es)".format(len(work), len(work_batches)))
+
+    for i, work_batch in enumerate(work_batches):
+        try:
+            logging.info("Running batch {}/{}".format(i+1, len(work_batches)))
+            results = worker_pool.map(partial(timed_call, func), work_batch)
+            for (result, busy_time) in results:
+                all_results.append(result)
+                if report is not None:
+                    report.add_worker_time(busy_time)
+        except KeyboardInterrupt:
+            print("interrupted, terminating process pool", file=sys.stderr)
+            worker_pool.terminate()
+            worker_pool.join()
+            sys.exit(1)
+
+    logging.info("Got {} results".format(len(all_results)))
+    return all_results
+
+# like parallelize, but yields results in completion order as they arrive
+def stream(worker_pool, func, work, chunksize=100):
+    logging.info("Streaming results of {} work tasks".format(len(work)))
+    report = get_report()
+
+    try:
+        for i, (result, busy_time) in enumerate(worker_pool.imap_unordered(partial(timed_call, func), work, chunksize=chunksize)):
+            if (i+1) % 10000 == 0:
+                logging.info("Got {}/{} results".format(i+1, len(work)))
+            if report is not None:
+                report.add_worker_time(busy_time)
+            yield result
+    except KeyboardInterrupt:
+        print("interrupted, terminating process pool", file=sys.stderr)
+        worker_pool.terminate()
+        worker_pool.join()
+        sys.exit(1)
+
+def load_json(filename):
+    filename = os.path.abspath(os.path.expanduser(filename))
+    if filename.endswith(".xz"):
+        with lzma.open(filename, 'rt') as fin:
+            return json.load(fin)
+    else:
+        with open(filename, 'r') as fin:
+            return json.load(fin)
+
+def save_json(data, filename):
+    logging.info("Saving data to disk as json in '{}'".format(filename))
+    if filename.endswith(".xz"):
+        with lzma.open(filename, 'wt') as outf:
+            json.dump(data, outf, indent=2)
+    else:
+        with open(filename, 'w') as outf:
+            json.dump(data, outf, indent=2)
+    if get_report() is not None:
+        get_report().add_output(filename)
+    logging.info("Done!")
+
+# name is shown in each log line, e.g., 'processor'; if logfilename is None
+# then we only log to stdout
+def setup_logging(name, logfilename=None):
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if logfilename is not None:
+        handlers.insert(0, logging.FileHandler(filename=logfilename))
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(created)f [' + name + '] [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        handlers=handlers,
+    )
+
+    if logfilename is not None:
+        logging.info("Logging system initialized! Logging events to stdout and to '{}'".format(logfilename))
+    else:
+        logging.info("Logging system initialized! Logging events to stdout.")
+
+class CustomHelpFormatter(ArgumentDefaultsHelpFormatter):
+    # adds the 'RawDescriptionHelpFormatter' to the ArgsDefault one
+    def _fill_text(self, text, width, indent):
+        return ''.join([indent + line for line in text.splitlines(True)])